@@ -0,0 +1,240 @@
+import argparse
+import json
+import logging
+import random
+import resource
+import time
+from distributed_node import ALGORITHMS, CentralNode, DistributedNode
+from membership import Membership
+from metrics import percentile
+from orquestrador import Orquestrador
+from print_server import NumberPrinter
+import runtime as runtime_module
+from runtime import AsyncioRuntime
+
+# Sobe orquestrador, print server e N nós no mesmo processo, em portas de
+# localhost e em um único event loop, e mede o cluster sob uma carga
+# determinística (semente fixa):
+#   closed  cada nó pede a CS de novo assim que sai (após --think segundos)
+#   rate    pedidos a uma taxa fixa total (--rate/s) dividida entre os nós
+#   skewed  como rate, mas --hot-share da taxa vai para os --hot primeiros nós
+# Pedidos que chegam com o nó ainda ocupado são contados como perdidos.
+
+
+class Recorder:
+    # Intervalos de CS vistos pelos nós, para latência e checagem de segurança.
+
+    def __init__(self, warmup_until):
+        self.warmup_until = warmup_until
+        self.requested = {}
+        self.entered = {}
+        self.latencies = []
+        self.intervals = []
+        self.entries = {}
+        self.missed = 0
+
+    def request(self, node):
+        if node.requesting or node.in_cs:
+            self.missed += 1
+            return
+        node.pick_resource()
+        self.requested[node.node_id] = time.monotonic()
+        node.request_cs()
+
+    def on_enter(self, node):
+        now = time.monotonic()
+        self.entered[node.node_id] = (now, node.resource, node.mode)
+        requested = self.requested.pop(node.node_id, None)
+        if requested is not None and requested >= self.warmup_until:
+            self.latencies.append(now - requested)
+
+    def on_exit(self, node):
+        start, printer, mode = self.entered.pop(node.node_id)
+        self.intervals.append((start, time.monotonic(), node.node_id, printer, mode))
+        if start >= self.warmup_until:
+            self.entries[node.node_id] = self.entries.get(node.node_id, 0) + 1
+
+
+def count_violations(intervals, per_resource):
+    # Dois intervalos sobrepostos são violação, a não ser que ambos sejam
+    # compartilhados ou (no modo central) em recursos diferentes.
+    violations = 0
+    active = []
+    for start, end, node_id, printer, mode in sorted(intervals):
+        active = [a for a in active if a[1] > start]
+        for other in active:
+            if per_resource and other[3] != printer:
+                continue
+            if mode == 1 and other[4] == 1:
+                continue
+            violations += 1
+        active.append((start, end, node_id, printer, mode))
+    return violations
+
+
+class Workload:
+    def __init__(self, args, runtime, nodes, recorder):
+        self.args = args
+        self.runtime = runtime
+        self.nodes = nodes
+        self.recorder = recorder
+
+    def start(self):
+        self.recorder.warmup_until = time.monotonic() + self.args.warmup
+        self.runtime.call_later(self.args.warmup + self.args.duration, self.runtime.stop)
+        if self.args.workload == 'closed':
+            for i, node in enumerate(self.nodes):
+                node.on_exit = self.chain(node.on_exit)
+                self.runtime.call_later(0.001 * i, self.recorder.request, node)
+            return
+
+        hot = self.args.hot if self.args.workload == 'skewed' else 0
+        share = self.args.hot_share if hot else 0.0
+        for i, node in enumerate(self.nodes):
+            if i < hot:
+                rate = self.args.rate * share / hot
+            else:
+                rate = self.args.rate * (1 - share) / (len(self.nodes) - hot)
+            if rate > 0:
+                interval = 1 / rate
+                self.runtime.call_later(interval * i / len(self.nodes), self.tick, node, interval)
+
+    def chain(self, on_exit):
+        def exited(node):
+            on_exit(node)
+            self.runtime.call_later(self.args.think, self.recorder.request, node)
+        return exited
+
+    def tick(self, node, interval):
+        self.recorder.request(node)
+        self.runtime.call_later(interval, self.tick, node, interval)
+
+
+def raise_fd_limit(needed):
+    # Em malha completa cada nó abre N-1 conexões e aceita outras N-1, tudo no mesmo processo.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and needed > hard:
+        raise SystemExit(f"{needed} file descriptors needed but the limit is {hard}; "
+                         f"use fewer nodes, raise the hard limit (ulimit -Hn) or use simulator.py")
+    if soft != resource.RLIM_INFINITY and needed > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run(args):
+    random.seed(args.seed)
+    # dois sockets por conexão, mais servidores, arquivos de log e folga
+    peers = 0 if args.algorithm == 'central' else args.nodes - 1
+    raise_fd_limit(2 * args.nodes * (peers + 1) + 3 * args.nodes + 64)
+    # todos os serviços estão vivos no mesmo loop: um connect lento é só o loop
+    # ocupado abrindo a malha, não um nó fora do ar
+    runtime_module.CONNECT_TIMEOUT = args.connect_timeout
+    host = '127.0.0.1'
+    nodes = {i: (host, args.base_port + i) for i in range(1, args.nodes + 1)}
+    membership = Membership(nodes, coordinator=(host, args.base_port),
+                            print_server=(host, args.base_port + args.nodes + 1))
+
+    level = getattr(logging, args.log_level)
+    runtime = AsyncioRuntime(logging.getLogger('Benchmark'))
+    printer = NumberPrinter(runtime, membership, args.printers, print_interval=args.print_interval)
+    orquestrador = Orquestrador(runtime, membership)
+    printer.logger.setLevel(level)
+    orquestrador.logger.setLevel(level)
+    printer.serve()
+    orquestrador.serve()
+
+    resources = [f'printer{i}' for i in range(args.printers)]
+    DistributedNode.RESOURCES = tuple(resources)
+    DistributedNode.SHARED_RATIO = args.shared_ratio
+    # os N(N-1) heartbeats da malha dividem o mesmo loop aqui, ao contrário de um nó por processo
+    DistributedNode.HEARTBEAT_INTERVAL = args.heartbeat
+    DistributedNode.SUSPECT_TIMEOUT = 4 * args.heartbeat
+    cls = ALGORITHMS[args.algorithm]
+    cluster = []
+    for node_id in membership.ids:
+        node = cls(node_id, membership, runtime)
+        node.logger.setLevel(level)
+        node.serve()
+        cluster.append(node)
+
+    recorder = Recorder(None)
+    for node in cluster:
+        node.on_enter = recorder.on_enter
+        node.on_exit = recorder.on_exit
+
+    # Abre a malha de conexões antes da carga: com N grande o connect de todos
+    # os links leva segundos e dispararia watchdogs e timeouts do protocolo.
+    links = [orquestrador.numbers_service]
+    for node in cluster:
+        links.append(node.coordinator)
+        if not isinstance(node, CentralNode):
+            links.extend(node.peers.values())
+    for link in links:
+        link.open()
+    workload = Workload(args, runtime, cluster, recorder)
+    opened = time.monotonic()
+
+    def wait_for_mesh():
+        if all(link.connected for link in links):
+            print(f"Opened {len(links)} connections in {time.monotonic() - opened:.1f}s")
+            workload.start()
+        else:
+            runtime.call_later(0.05, wait_for_mesh)
+
+    runtime.call_soon(wait_for_mesh)
+    runtime.run_forever()
+
+    entries = sum(recorder.entries.values())
+    messages = sum(value for node in cluster for name, value in node.metrics.counters.items()
+                   if name.startswith('sent.'))
+    peer_messages = messages - sum(node.metrics.counters.get(f'sent.{kind}', 0)
+                                   for node in cluster for kind in ('ENTER', 'EXIT'))
+    per_node = [recorder.entries.get(node.node_id, 0) for node in cluster]
+    return {
+        'config': vars(args),
+        'entries': entries,
+        'entries_per_sec': entries / args.duration,
+        'acquire_latency_ms': {
+            'mean': 1000 * sum(recorder.latencies) / len(recorder.latencies) if recorder.latencies else 0.0,
+            'p50': 1000 * percentile(recorder.latencies, 50),
+            'p99': 1000 * percentile(recorder.latencies, 99),
+            'max': 1000 * max(recorder.latencies, default=0.0),
+        },
+        # contadores cobrem também o aquecimento, então são divididos pelo total de entradas
+        'messages_per_entry': messages / max(1, len(recorder.intervals)),
+        'peer_messages_per_entry': peer_messages / max(1, len(recorder.intervals)),
+        'missed_requests': recorder.missed,
+        'entries_per_node': {'min': min(per_node), 'max': max(per_node)},
+        'safety_violations': count_violations(recorder.intervals, args.algorithm == 'central'),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=6)
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='ricart')
+    parser.add_argument('--workload', choices=['closed', 'rate', 'skewed'], default='closed')
+    parser.add_argument('--think', type=float, default=0.0, help='closed: pausa entre saída e novo pedido (s)')
+    parser.add_argument('--rate', type=float, default=100.0, help='rate/skewed: pedidos por segundo no cluster')
+    parser.add_argument('--hot', type=int, default=1, help='skewed: quantidade de nós quentes')
+    parser.add_argument('--hot-share', type=float, default=0.8, help='skewed: fração da taxa dos nós quentes')
+    parser.add_argument('--printers', type=int, default=1)
+    parser.add_argument('--shared-ratio', type=float, default=0.0)
+    parser.add_argument('--print-interval', type=float, default=0.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--base-port', type=int, default=7000)
+    parser.add_argument('--connect-timeout', type=float, default=30.0)
+    parser.add_argument('--heartbeat', type=float, default=1.0, help='intervalo de heartbeat entre os nós (0 desliga)')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='ERROR')
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    result = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    latency = result['acquire_latency_ms']
+    print(f"{args.algorithm}/{args.workload} N={args.nodes}: {result['entries_per_sec']:.1f} entries/s, "
+          f"acquire p50={latency['p50']:.2f}ms p99={latency['p99']:.2f}ms, "
+          f"{result['messages_per_entry']:.1f} msgs/entry, "
+          f"{result['safety_violations']} safety violations -> {args.output}")
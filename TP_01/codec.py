@@ -0,0 +1,177 @@
+import struct
+from collections import namedtuple
+
+# Protocolo binário comum a todos os serviços.
+#
+# frame   = tamanho (uint32) + uma ou mais mensagens
+# mensagem = kind (uint8) | sender (uint32) | clock (int64) | value (int64)
+#            | tamanho do payload (uint32) | payload
+#
+# Um frame pode carregar várias mensagens, então REQUEST/REPLY pendentes para
+# o mesmo destino saem em um único send.
+
+FRAME_HEADER = struct.Struct('!I')
+MESSAGE_HEADER = struct.Struct('!BIqqI')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+COUNT = struct.Struct('!I')
+TOKEN_ENTRY = struct.Struct('!Iq')
+NODE_ID = struct.Struct('!I')
+
+# ENTER leva o modo em value e o nome do recurso no payload; as respostas do
+# orquestrador e do print server repetem o recurso no payload.
+MODE_EXCLUSIVE = 0
+MODE_SHARED = 1
+DEFAULT_RESOURCE = 'printer0'
+
+REQUEST = 1
+REPLY = 2
+ENTER = 3
+ENTER_OK = 4
+ENTER_DENIED = 5
+EXIT = 6
+EXIT_OK = 7
+START = 8
+STARTED = 9
+DONE = 10
+STOP = 11
+STOPPED = 12
+LOCKED = 13
+RELEASE = 14
+INQUIRE = 15
+RELINQUISH = 16
+FAILED = 17
+TOKEN = 18
+TOKEN_QUERY = 19
+TOKEN_STATUS = 20
+STATS = 21
+STATS_REPLY = 22
+HEARTBEAT = 23
+
+KIND_NAMES = {
+    REQUEST: 'REQUEST',
+    REPLY: 'REPLY',
+    ENTER: 'ENTER',
+    ENTER_OK: 'ENTER_OK',
+    ENTER_DENIED: 'ENTER_DENIED',
+    EXIT: 'EXIT',
+    EXIT_OK: 'EXIT_OK',
+    START: 'START',
+    STARTED: 'STARTED',
+    DONE: 'DONE',
+    STOP: 'STOP',
+    STOPPED: 'STOPPED',
+    LOCKED: 'LOCKED',
+    RELEASE: 'RELEASE',
+    INQUIRE: 'INQUIRE',
+    RELINQUISH: 'RELINQUISH',
+    FAILED: 'FAILED',
+    TOKEN: 'TOKEN',
+    TOKEN_QUERY: 'TOKEN_QUERY',
+    TOKEN_STATUS: 'TOKEN_STATUS',
+    STATS: 'STATS',
+    STATS_REPLY: 'STATS_REPLY',
+    HEARTBEAT: 'HEARTBEAT',
+}
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Message(namedtuple('Message', 'kind sender clock value payload')):
+    __slots__ = ()
+
+    def __new__(cls, kind, sender=0, clock=0, value=0, payload=b''):
+        return super().__new__(cls, kind, sender, clock, value, payload)
+
+    @property
+    def name(self):
+        return KIND_NAMES.get(self.kind, str(self.kind))
+
+    @property
+    def text(self):
+        return self.payload.decode()
+
+    def __str__(self):
+        return f"{self.name}(sender={self.sender}, clock={self.clock}, value={self.value})"
+
+
+def encode_frame(messages):
+    parts = [b'']
+    for m in messages:
+        parts.append(MESSAGE_HEADER.pack(m.kind, m.sender, m.clock, m.value, len(m.payload)))
+        if m.payload:
+            parts.append(m.payload)
+    body = b''.join(parts)
+    if len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"frame too large: {len(body)} bytes")
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def decode_frame(body):
+    messages = []
+    offset = 0
+    end = len(body)
+    while offset < end:
+        if end - offset < MESSAGE_HEADER.size:
+            raise ProtocolError("truncated message header")
+        kind, sender, clock, value, size = MESSAGE_HEADER.unpack_from(body, offset)
+        offset += MESSAGE_HEADER.size
+        if end - offset < size:
+            raise ProtocolError("truncated message payload")
+        messages.append(Message(kind, sender, clock, value, bytes(body[offset:offset + size])))
+        offset += size
+    return messages
+
+
+def encode_token(ln, queue):
+    # Payload do token de Suzuki-Kasami: vetor LN (id -> último pedido atendido) e fila de ids.
+    parts = [COUNT.pack(len(ln))]
+    parts.extend(TOKEN_ENTRY.pack(node_id, served) for node_id, served in ln.items())
+    parts.append(COUNT.pack(len(queue)))
+    parts.extend(NODE_ID.pack(node_id) for node_id in queue)
+    return b''.join(parts)
+
+
+def decode_token(payload):
+    try:
+        count, = COUNT.unpack_from(payload, 0)
+        offset = COUNT.size
+        ln = {}
+        for _ in range(count):
+            node_id, served = TOKEN_ENTRY.unpack_from(payload, offset)
+            ln[node_id] = served
+            offset += TOKEN_ENTRY.size
+        count, = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        queue = [NODE_ID.unpack_from(payload, offset + i * NODE_ID.size)[0] for i in range(count)]
+    except struct.error as e:
+        raise ProtocolError(f"malformed token: {e}")
+    return ln, queue
+
+
+def read_frame_size(header):
+    size, = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ProtocolError(f"frame too large: {size} bytes")
+    return size
+
+
+class FrameDecoder:
+    # Remonta frames a partir de leituras parciais do socket.
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= FRAME_HEADER.size:
+            size = read_frame_size(self.buffer[:FRAME_HEADER.size])
+            end = FRAME_HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            with memoryview(self.buffer) as view:
+                messages.extend(decode_frame(view[FRAME_HEADER.size:end]))
+            del self.buffer[:end]
+        return messages
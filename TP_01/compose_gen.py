@@ -0,0 +1,85 @@
+import argparse
+
+# Gera o docker-compose.yml para um cluster de N nós. Os nós descobrem os
+# demais pela variável CLUSTER_SIZE (hosts node{id}, portas 5000 + id).
+
+HEADER = """x-common: &default-config
+  privileged: true
+  build:
+    context: .
+    dockerfile: Dockerfile
+  user: "root"
+  volumes:
+    - ./logs:/app/logs
+  environment:
+    CLUSTER_SIZE: "{size}"
+  depends_on:
+    - orquestrador
+
+services:
+
+  print_server:
+    privileged: true
+    build:
+      context: .
+      dockerfile: Dockerfile
+    container_name: print_server
+    command: bash -c "rm -rf /app/logs/* && mkdir -p /app/logs && chmod 777 /app/logs && python3 print_server.py{print_extra}"
+    user: "root"
+    volumes:
+      -  ./logs:/app/logs:rw
+
+  orquestrador:
+    privileged: true
+    build:
+      context: .
+      dockerfile: Dockerfile
+    container_name: orquestrador
+    command: python3 orquestrador.py{extra}
+    user: "root"
+    volumes:
+      - ./logs:/app/logs
+    environment:
+      CLUSTER_SIZE: "{size}"
+    depends_on:
+      - print_server
+"""
+
+NODE = """
+  node{id}:
+    <<: *default-config
+    container_name: node{id}
+    command: python3 distributed_node.py --id {id}{extra}
+"""
+
+FOOTER = """
+networks:
+  app-network:
+    driver: bridge
+"""
+
+
+def render(size, engine=None, algorithm=None, printers=1):
+    extra = f" --engine {engine}" if engine else ""
+    node_extra = extra + (f" --algorithm {algorithm}" if algorithm else "")
+    print_extra = extra
+    if printers > 1:
+        print_extra += f" --printers {printers}"
+        node_extra += " --resources " + ','.join(f'printer{i}' for i in range(printers))
+    parts = [HEADER.format(size=size, extra=extra, print_extra=print_extra)]
+    parts.extend(NODE.format(id=i, extra=node_extra) for i in range(1, size + 1))
+    parts.append(FOOTER)
+    return ''.join(parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=6)
+    parser.add_argument('--engine', help='engine repassado a todos os serviços (recomendado asyncio para clusters grandes)')
+    parser.add_argument('--algorithm', help='algoritmo de exclusão mútua dos nós')
+    parser.add_argument('--printers', type=int, default=1, help='impressoras no print server; os nós disputam todas')
+    parser.add_argument('--output', default='docker-compose.yml')
+    args = parser.parse_args()
+    with open(args.output, 'w') as f:
+        f.write(render(args.nodes, args.engine, args.algorithm, args.printers))
+    print(f"Wrote {args.output} with {args.nodes} nodes")
@@ -1,220 +1,390 @@
 import argparse
-import socket
+import functools
 import threading
 import time
 import random
-import logging
-import os
-from queue import Queue
+from codec import (Message, ENTER, ENTER_OK, EXIT, EXIT_OK, DONE, HEARTBEAT,
+                   MODE_EXCLUSIVE, MODE_SHARED, DEFAULT_RESOURCE, STATS, STATS_REPLY)
+import failure_detector
+from failure_detector import FailureDetector
+import logutil
+from membership import load_membership
+from metrics import Metrics
+from mutex_core import Send, Timer, CentralCore, RicartAgrawala, Maekawa, SuzukiKasami
+from runtime import ENGINES, ThreadRuntime, make_runtime
 
 def setup_logging(node_id):
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-    logger = logging.getLogger(f'Node{node_id}')
-    logger.setLevel(logging.INFO)
-    if not logger.handlers:
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler = logging.FileHandler(f'logs/node_{node_id}.log')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-    return logger
+    return logutil.setup_logging(f'Node{node_id}', f'node_{node_id}.log')
 
 class DistributedNode:
+    # Adaptador entre um núcleo de mutex_core e a rede: entrega ao núcleo as
+    # mensagens recebidas, falhas de envio e timers, e executa os efeitos que ele
+    # devolve (envios, timers, entrada na CS). A CS em si (orquestrador, print
+    # server, watchdog, métricas) fica aqui. O padrão é Ricart-Agrawala.
+    # Os pares são monitorados por heartbeat: um par suspeito vira peer_down no
+    # núcleo, e a concessão do orquestrador é renovada enquanto o nó está na CS.
     CS_DURATION = 10
+    REUSE_PERMISSIONS = True
+    RESOURCES = (DEFAULT_RESOURCE,)
+    SHARED_RATIO = 0.0
+    HEARTBEAT_INTERVAL = failure_detector.HEARTBEAT_INTERVAL
+    SUSPECT_TIMEOUT = failure_detector.SUSPECT_TIMEOUT
 
-    def __init__(self, node_id, port, other_nodes):
+    def __init__(self, node_id, membership, runtime=None, port=None):
         self.node_id = node_id
-        self.port = port
-        self.other_nodes = other_nodes
+        self.membership = membership
+        self.port = port or membership.address(node_id)[1]
         self.logger = setup_logging(node_id)
+        self.runtime = runtime or ThreadRuntime(self.logger)
+        self.metrics = Metrics(f'node{node_id}')
+        self.core = self.make_core()
         self.init_state()
+        self.peers = {
+            peer_id: self.runtime.connect(host, peer_port, on_failure=functools.partial(self.on_link_failure, peer_id))
+            for peer_id, (host, peer_port) in membership.peers(node_id).items()
+        }
+        self.coordinator = self.runtime.connect(*membership.coordinator,
+                                                on_message=self.handle_coordinator_message,
+                                                on_failure=self.on_coordinator_failure)
+        self.detector = FailureDetector(self.runtime, self.SUSPECT_TIMEOUT, self.on_peer_suspected,
+                                        self.on_peer_recovered, self.HEARTBEAT_INTERVAL, self.send_heartbeat)
+        for peer_id in self.monitored_peers():
+            self.detector.watch(peer_id)
+        for name, read in self.core.gauges().items():
+            self.metrics.gauge(name, read)
+        self.metrics.gauge('suspected', lambda: len(self.detector.suspected))
+
+    def make_core(self):
+        return RicartAgrawala(self.node_id, self.membership.ids, self.REUSE_PERMISSIONS, self.logger)
+
+    def monitored_peers(self):
+        return self.peers
 
     def init_state(self):
-        self.clock = 0
-        self.deferred = set()
-        self.request_queue = []
-        self.requesting = False
         self.in_cs = False
-        self.awaiting_replies_from = set()
-        self.reply_queue = Queue()
         self.lock = threading.Lock()
         self.running = True
         self.cs_start_time = 0
+        self.request_started = None
+        self.watchdog = None
+        self.lease_timer = None
+        self.channel_peers = {}
+        # ganchos opcionais (benchmark.py): chamados com o nó ao entrar e sair da CS
+        self.on_enter = None
+        self.on_exit = None
+        self.resource = DEFAULT_RESOURCE
+        self.mode = MODE_EXCLUSIVE
+        self.print_job = 0
 
-    def run_server(self):
-        with socket.socket() as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind(('0.0.0.0', self.port))
-            s.settimeout(1)
-            s.listen()
-            while self.running:
-                try:
-                    conn, addr = s.accept()
-                    threading.Thread(target=self.handle_connection, args=(conn, addr)).start()
-                except socket.timeout:
-                    continue
-
-    def handle_connection(self, conn, addr):
-        with conn:
-            try:
-                data = conn.recv(1024).decode().strip()
-                if data.startswith('REQUEST'):
-                    self.handle_request(data)
-                elif data.startswith('REPLY'):
-                    self.handle_reply(data)
-            except Exception as e:
-                self.logger.error(f"Connection error: {e}")
-
-    def handle_request(self, data):
-        _, ts, node_id = data.split(',')
-        ts, node_id = int(ts), int(node_id)
-        with self.lock:
-            self.update_clock(ts)
-            self.request_queue.append((ts, node_id))
-            self.request_queue.sort()
-            if not self.requesting or self.should_grant(ts, node_id):
-                self.send_reply(node_id)
-                self.logger.info(f"Granted access to Node {node_id}")
+    @property
+    def requesting(self):
+        return self.core.requesting
+
+    @property
+    def clock(self):
+        return self.core.clock
+
+    def apply(self, effects):
+        # Chamado com self.lock adquirido.
+        for effect in effects:
+            if type(effect) is Send:
+                self.send_to(effect.dest, effect.message)
+            elif type(effect) is Timer:
+                self.runtime.call_later(effect.delay, self.on_core_timer, effect.name, effect.key)
             else:
-                self.deferred.add(node_id)
-                self.logger.info(f"Deferred Node {node_id}")
+                self.enter_cs()
 
-    def handle_reply(self, data):
-        _, ts, node_id = data.split(',')
-        ts, node_id = int(ts), int(node_id)
+    def on_core_timer(self, name, key):
         with self.lock:
-            self.update_clock(ts)
-            if node_id in self.awaiting_replies_from:
-                self.awaiting_replies_from.remove(node_id)
-                self.logger.info(f"Received REPLY from Node {node_id} ({len(self.other_nodes) - len(self.awaiting_replies_from)}/{len(self.other_nodes)})")
-            if not self.awaiting_replies_from:
-                self.enter_cs()
+            self.apply(self.core.timer(name, key))
 
-    def request_loop(self):
-        while self.running:
-            if not self.in_cs:
-                time.sleep(random.uniform(1, 3))
-                if random.random() > 0.5:
-                    self.request_cs()
+    def handle_message(self, channel, message):
+        self.metrics.incr(f'recv.{message.name}')
+        if message.kind == STATS:
+            channel.send(Message(STATS_REPLY, self.node_id, payload=self.metrics.encode()))
+            return
+        self.detector.heard(message.sender)
+        if channel is not None and channel not in self.channel_peers:
+            self.channel_peers[channel] = message.sender
+        if message.kind == HEARTBEAT:
+            return
+        with self.lock:
+            self.apply(self.core.receive(message))
+
+    def send_to(self, node_id, message):
+        # Mensagens para o próprio nó (Maekawa inclui o nó no seu quórum) passam pelo runtime.
+        self.metrics.incr(f'sent.{message.name}')
+        if node_id == self.node_id:
+            self.runtime.call_soon(self.handle_message, None, message)
+        else:
+            self.detector.sent(node_id)
+            self.peers[node_id].send(message)
+
+    def send_heartbeat(self, node_id):
+        self.metrics.incr('heartbeats')
+        self.peers[node_id].send(Message(HEARTBEAT, self.node_id))
+
+    def on_peer_disconnect(self, channel):
+        # conexão de entrada fechada: o processo do par caiu, sem esperar o silêncio
+        node_id = self.channel_peers.pop(channel, None)
+        if node_id is not None and self.running:
+            self.detector.suspect(node_id)
+
+    def on_peer_suspected(self, node_id):
+        self.metrics.incr('suspicions')
+        self.logger.warning(f"Node {node_id} suspected", extra=self.core.event('suspect', peer=node_id))
+        with self.lock:
+            self.apply(self.core.peer_down(node_id))
+
+    def on_peer_recovered(self, node_id):
+        self.logger.info(f"Node {node_id} is alive again", extra=self.core.event('recover', peer=node_id))
+        with self.lock:
+            self.apply(self.core.peer_up(node_id))
+
+    def schedule_request(self):
+        if self.running:
+            self.runtime.call_later(random.uniform(1, 3), self.request_tick)
+
+    def request_tick(self):
+        if not self.in_cs and not self.requesting and random.random() > 0.5:
+            self.pick_resource()
+            self.request_cs()
+        self.schedule_request()
+
+    def pick_resource(self):
+        self.resource = random.choice(self.RESOURCES)
+        self.mode = MODE_SHARED if random.random() < self.SHARED_RATIO else MODE_EXCLUSIVE
 
     def request_cs(self):
         with self.lock:
             if self.requesting:
                 return  # já solicitando
-            
-            self.clock += 1
-            self.requesting = True
-            self.awaiting_replies_from = {port - 5000 for _, port in self.other_nodes}
-            self.request_queue.append((self.clock, self.node_id))
-            self.request_queue.sort()
-            self.logger.info(f"Requesting CS with timestamp {self.clock}")
-
-            for host, port in self.other_nodes:
-                threading.Thread(target=self.send_request, args=(host, port, self.clock), daemon=True).start()
-
-    def send_request(self, host, port, ts):
-        try:
-            with socket.socket() as s:
-                s.settimeout(2)
-                s.connect((host, port))
-                s.sendall(f"REQUEST,{ts},{self.node_id}".encode())
-        except Exception as e:
-            with self.lock:
-                nid = port - 5000
-                if nid in self.awaiting_replies_from:
-                    self.awaiting_replies_from.remove(nid)
-            self.logger.warning(f"Failed to connect to {host}:{port}")
+            self.request_started = time.monotonic()
+            self.apply(self.core.request())
+
+    def send_coordinator(self, message):
+        self.metrics.incr(f'sent.{message.name}')
+        self.coordinator.send(message)
+
+    def on_link_failure(self, node_id, message):
+        self.metrics.incr('undeliverable_msgs')
+        self.on_send_failure(node_id, message)
+
+    def on_send_failure(self, node_id, message):
+        if message.kind == HEARTBEAT:
+            return  # o detector cuida do par calado
+        link = self.peers[node_id]
+        self.logger.warning(f"Failed to deliver {message.name} to {link.host}:{link.port}",
+                            extra=self.core.event('undeliverable', peer=node_id, kind=message.name))
+        with self.lock:
+            self.apply(self.core.peer_failed(node_id, message))
 
     def enter_cs(self):
         if self.in_cs:
             return
+        self.begin_cs()
+        self.send_coordinator(Message(ENTER, self.node_id, self.clock, self.mode, self.resource.encode()))
+
+    def begin_cs(self):
         self.in_cs = True
         self.cs_start_time = time.time()
-        self.logger.info("=== ENTERING CRITICAL SECTION ===")
-
-        def watchdog():
-            time.sleep(self.CS_DURATION + 2)
-            if self.in_cs:
-                self.logger.warning("CS watchdog triggered - forcing exit")
-                self.exit_cs()
-
-        threading.Thread(target=watchdog, daemon=True).start()
-        threading.Thread(target=self._execute_cs, daemon=True).start()
-
-    def _execute_cs(self):
-        try:
-            with socket.socket() as s:
-                s.settimeout(15)
-                s.connect(('orquestrador', 5000))
-                s.sendall(f"ENTER:{self.node_id}:{self.clock}".encode())
-                response = s.recv(1024).decode().strip()
-                if response != "ENTER_OK":
-                    self.logger.error(f"Server denied access: {response}")
-                    return
-                self.logger.info("=== IN CRITICAL SECTION ===")
-                
-                s.sendall(b"EXIT")
-                if s.recv(1024).decode().strip() == "EXIT_OK":
-                    self.logger.info("=== EXITING CRITICAL SECTION ===")
-        except Exception as e:
-            self.logger.error(f"CS error: {e}")
-        finally:
+        self.metrics.incr('cs_entries')
+        if self.request_started is not None:
+            self.metrics.observe('cs_wait', time.monotonic() - self.request_started)
+            self.request_started = None
+        if self.on_enter:
+            self.on_enter(self)
+        mode = 'shared' if self.mode == MODE_SHARED else 'exclusive'
+        self.logger.info(f"=== ENTERING CRITICAL SECTION === ({self.resource}, {mode})",
+                         extra=self.core.event('enter', clock=self.clock, resource=self.resource, mode=mode))
+        self.watchdog = self.runtime.call_later(self.CS_DURATION + 2, self.on_watchdog)
+
+    def on_watchdog(self):
+        if self.in_cs:
+            self.logger.warning("CS watchdog triggered - forcing exit")
+            self.exit_cs()
+
+    def handle_coordinator_message(self, channel, response):
+        self.metrics.incr(f'recv.{response.name}')
+        resource = response.text or DEFAULT_RESOURCE
+        if response.kind == ENTER_OK and (not self.in_cs or resource != self.resource):
+            # concessão atrasada (ex.: após o watchdog): devolve o recurso na hora
+            self.logger.warning(f"Releasing stale grant of {resource}")
+            self.send_coordinator(Message(EXIT, self.node_id, payload=response.payload))
+            return
+        if not self.in_cs or resource != self.resource:
+            return
+        if response.kind == ENTER_OK:
+            # value traz o job de impressão a aguardar (0 em modo compartilhado)
+            # e clock o lease da concessão em ms
+            self.print_job = response.value
+            self.start_lease(response.clock)
+            self.logger.info("=== IN CRITICAL SECTION ===")
+            if not self.print_job:
+                self.send_coordinator(Message(EXIT, self.node_id, payload=response.payload))
+        elif response.kind == DONE:
+            if response.clock != self.print_job:
+                return
+            self.print_job = 0
+            self.logger.info(f"Print job finished at {response.value}")
+            self.send_coordinator(Message(EXIT, self.node_id, payload=response.payload))
+        elif response.kind == EXIT_OK:
+            self.logger.info("=== EXITING CRITICAL SECTION ===")
+            self.exit_cs()
+        else:
+            self.logger.error(f"Server denied access: {response.text or response.name}")
             self.exit_cs()
 
+    def start_lease(self, lease_ms):
+        # Sem sinal de vida o orquestrador expira a concessão sozinho: renova a cada terço do lease.
+        if lease_ms > 0 and self.lease_timer is None:
+            self.lease_timer = self.runtime.call_later(lease_ms / 3000, self.renew_lease, lease_ms)
+
+    def renew_lease(self, lease_ms):
+        with self.lock:
+            self.lease_timer = None
+            if not self.in_cs:
+                return
+            self.send_coordinator(Message(HEARTBEAT, self.node_id))
+            self.start_lease(lease_ms)
+
+    def on_coordinator_failure(self, message):
+        self.metrics.incr('undeliverable_msgs')
+        self.logger.error(f"CS error: could not deliver {message} to orquestrador")
+        self.exit_cs()
+
     def exit_cs(self):
         with self.lock:
             if not self.in_cs:
                 return
             self.in_cs = False
-            self.requesting = False
-            self.awaiting_replies_from.clear()
-            self.request_queue = [r for r in self.request_queue if r[1] != self.node_id]
-            self.logger.info(f"Time spent in CS: {time.time() - self.cs_start_time}s")
-            self.logger.info("=== LEFT CRITICAL SECTION ===")
-            deferred = list(self.deferred)
-            self.deferred.clear()
-        for node_id in deferred:
-            self.send_reply(node_id)
-
-    def send_reply(self, node_id):
-        host, port = next((h, p) for h, p in self.other_nodes if p == 5000 + node_id)
-        try:
-            with socket.socket() as s:
-                s.settimeout(2)
-                s.connect((host, port))
-                s.sendall(f"REPLY,{self.clock},{self.node_id}".encode())
-        except Exception:
-            self.logger.warning(f"Failed to send reply to Node {node_id}")
-
-    def update_clock(self, received_ts):
-        self.clock = max(self.clock, received_ts) + 1
-
-    def should_grant(self, ts, node_id):
-        my_req = (self.clock, self.node_id)
-        return (ts, node_id) < my_req
+            if self.watchdog:
+                self.watchdog.cancel()
+                self.watchdog = None
+            if self.lease_timer:
+                self.lease_timer.cancel()
+                self.lease_timer = None
+            held = time.time() - self.cs_start_time
+            self.metrics.observe('cs_hold', held)
+            self.logger.info(f"Time spent in CS: {held}s")
+            self.logger.info("=== LEFT CRITICAL SECTION ===",
+                             extra=self.core.event('exit', clock=self.clock, resource=self.resource, held=held))
+            if self.on_exit:
+                self.on_exit(self)
+            self.apply(self.core.release())
 
     def shutdown(self):
         self.running = False
+        self.detector.stop()
+        for link in self.peers.values():
+            link.close()
+        self.coordinator.close()
+        self.runtime.stop()
         self.logger.info("Shutting down")
 
-    def start(self):
+    def serve(self):
+        self.runtime.listen(self.port, self.handle_message, self.on_peer_disconnect)
+        if self.HEARTBEAT_INTERVAL > 0:
+            self.detector.start()
         self.logger.info(f"Node {self.node_id} started on port {self.port}")
-        threading.Thread(target=self.run_server, daemon=True).start()
-        threading.Thread(target=self.request_loop, daemon=True).start()
-        try:
-            while self.running:
-                time.sleep(0.1)
-        except KeyboardInterrupt:
+
+    def start(self):
+        self.serve()
+        self.schedule_request()
+        self.runtime.run_forever()
+        if self.running:
             self.shutdown()
 
+class MaekawaNode(DistributedNode):
+    # Maekawa com quóruns em grade (~2*sqrt(N) nós); o protocolo está em mutex_core.Maekawa.
+    RETRY_TIMEOUT = 5
+
+    def make_core(self):
+        return Maekawa(self.node_id, self.membership.ids, logger=self.logger, retry_timeout=self.RETRY_TIMEOUT)
+
+    @property
+    def quorum(self):
+        return self.core.quorum
+
+    def monitored_peers(self):
+        # Só o quórum da grade troca mensagens com este nó: a mesma linha e coluna,
+        # que são também os nós que usam este nó como árbitro
+        return self.core.home_quorum - {self.node_id}
+
+class TokenNode(DistributedNode):
+    # Suzuki-Kasami com regeneração do token; o protocolo está em mutex_core.SuzukiKasami.
+    TOKEN_TIMEOUT = 15
+    PROBE_TIMEOUT = 2
+
+    def make_core(self):
+        return SuzukiKasami(self.node_id, self.membership.ids, self.TOKEN_TIMEOUT, self.PROBE_TIMEOUT,
+                            logger=self.logger)
+
+    @property
+    def has_token(self):
+        return self.core.has_token
+
+class CentralNode(DistributedNode):
+    # Sem exclusão mútua entre os nós: o orquestrador é o gerenciador de locks
+    # e enfileira os pedidos por recurso. Nós usando recursos diferentes entram
+    # em paralelo, o que os algoritmos distribuídos acima (um único lock global) não permitem.
+
+    def make_core(self):
+        return CentralCore(self.node_id, self.membership.ids, self.logger)
+
+    def monitored_peers(self):
+        return ()  # não há tráfego entre os nós
+
+    def enter_cs(self):
+        # O núcleo libera na hora; a CS só começa com o ENTER_OK do orquestrador.
+        self.logger.info(f"Requesting {self.resource} from orquestrador")
+        self.send_coordinator(Message(ENTER, self.node_id, self.clock, self.mode, self.resource.encode()))
+
+    def handle_coordinator_message(self, channel, response):
+        if response.kind == ENTER_OK and self.requesting and not self.in_cs \
+                and (response.text or DEFAULT_RESOURCE) == self.resource:
+            with self.lock:
+                self.begin_cs()
+        super().handle_coordinator_message(channel, response)
+
+    def on_coordinator_failure(self, message):
+        super().on_coordinator_failure(message)
+        with self.lock:
+            if not self.in_cs:
+                self.core.release()
+
+ALGORITHMS = {
+    'central': CentralNode,
+    'ricart': DistributedNode,
+    'maekawa': MaekawaNode,
+    'token': TokenNode,
+}
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--id', type=int, required=True)
-    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--port', type=int, help='sobrescreve a porta definida na configuração do cluster')
+    parser.add_argument('--config', help='arquivo JSON com a composição do cluster (padrão: variáveis de ambiente)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='thread')
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='ricart')
+    parser.add_argument('--no-permission-reuse', action='store_true',
+                        help='Ricart-Agrawala sem a otimização de Roucairol-Carvalho')
+    parser.add_argument('--resources', default=DEFAULT_RESOURCE,
+                        help='recursos (impressoras) disputados, separados por vírgula, ex.: printer0,printer1')
+    parser.add_argument('--shared-ratio', type=float, default=0.0,
+                        help='fração dos pedidos feitos em modo compartilhado (leitura)')
+    parser.add_argument('--heartbeat', type=float, default=failure_detector.HEARTBEAT_INTERVAL,
+                        help='intervalo de heartbeat entre os nós em segundos (0 desliga o detector)')
+    parser.add_argument('--suspect-timeout', type=float, default=failure_detector.SUSPECT_TIMEOUT,
+                        help='silêncio, em segundos, para um nó ser considerado fora do ar')
     args = parser.parse_args()
-    other_nodes = [(f'node{i}', 5000 + i) for i in range(1, 7) if 5000 + i != args.port]
-    node = DistributedNode(args.id, args.port, other_nodes)
+    if args.no_permission_reuse:
+        DistributedNode.REUSE_PERMISSIONS = False
+    DistributedNode.RESOURCES = tuple(name.strip() for name in args.resources.split(',') if name.strip())
+    DistributedNode.SHARED_RATIO = args.shared_ratio
+    DistributedNode.HEARTBEAT_INTERVAL = args.heartbeat
+    DistributedNode.SUSPECT_TIMEOUT = args.suspect_timeout
+    membership = load_membership(args.config)
+    runtime = make_runtime(args.engine, setup_logging(args.id))
+    node = ALGORITHMS[args.algorithm](args.id, membership, runtime, port=args.port)
     node.start()
@@ -0,0 +1,82 @@
+import time
+
+# Detector de falhas por heartbeat, usado pelos nós (entre si) e pelo
+# orquestrador (para os donos de concessões). Qualquer mensagem recebida conta
+# como sinal de vida; quem recebe `heartbeat` só manda HEARTBEAT para chaves
+# sem nenhum envio no último intervalo. Uma chave silenciosa por mais que
+# `timeout` é suspeita (on_suspect) até voltar a ser ouvida (on_recover).
+# Chaves nunca ouvidas não são suspeitas: quem nunca respondeu é detectado
+# pela falha de conexão, como antes. suspect() antecipa a suspeita quando há
+# um sinal mais rápido que o silêncio (ex.: a conexão do par foi fechada).
+
+HEARTBEAT_INTERVAL = 0.5
+SUSPECT_TIMEOUT = 2.0
+
+
+class FailureDetector:
+    def __init__(self, runtime, timeout, on_suspect, on_recover=None, interval=None, heartbeat=None):
+        self.runtime = runtime
+        self.timeout = timeout
+        self.interval = interval or timeout / 4
+        self.on_suspect = on_suspect
+        self.on_recover = on_recover
+        self.heartbeat = heartbeat
+        self.last_seen = {}
+        self.last_sent = {}
+        self.suspected = set()
+        self.last_tick = None
+        self.running = False
+
+    def watch(self, key):
+        self.last_seen.setdefault(key, None)
+
+    def unwatch(self, key):
+        self.last_seen.pop(key, None)
+        self.last_sent.pop(key, None)
+        self.suspected.discard(key)
+
+    def heard(self, key):
+        if key not in self.last_seen:
+            return
+        self.last_seen[key] = time.monotonic()
+        if key in self.suspected:
+            self.suspected.discard(key)
+            if self.on_recover:
+                self.runtime.dispatch(self.on_recover, key)
+
+    def suspect(self, key):
+        if key in self.last_seen and key not in self.suspected:
+            self.suspected.add(key)
+            self.runtime.dispatch(self.on_suspect, key)
+
+    def sent(self, key):
+        self.last_sent[key] = time.monotonic()
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.last_tick = time.monotonic()
+            self.runtime.call_later(self.interval, self.tick)
+
+    def stop(self):
+        self.running = False
+
+    def tick(self):
+        if not self.running:
+            return
+        now = time.monotonic()
+        stalled = now - self.last_tick > self.timeout
+        self.last_tick = now
+        for key, seen in list(self.last_seen.items()):
+            if self.heartbeat and now - self.last_sent.get(key, 0) >= self.interval:
+                self.last_sent[key] = now
+                self.heartbeat(key)
+            if seen is None or key in self.suspected:
+                continue
+            if stalled:
+                # o próprio processo ficou parado: as mensagens dos outros podem
+                # estar esperando na fila, então recomeça a contagem em vez de suspeitar
+                self.last_seen[key] = now
+            elif now - seen > self.timeout:
+                self.suspect(key)
+        self.runtime.call_later(self.interval, self.tick)
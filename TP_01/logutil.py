@@ -0,0 +1,150 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+# Logging assíncrono compartilhado pelos serviços: o handler só coloca o
+# registro em uma fila limitada (sem I/O, seguro dentro de um lock) e um único
+# thread escritor por processo junta os registros e grava em lote, quando o
+# lote enche ou o intervalo vence. Com a fila cheia o registro é descartado e
+# contado, em vez de bloquear quem está logando. LOG_EVENTS=1 grava também um
+# log de eventos em JSON lines (logs/<serviço>.events.jsonl); os campos passados em
+# extra={'event': {...}} (ver MutexCore.event) entram no registro.
+
+LOG_DIR = 'logs'
+FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+QUEUE_SIZE = 100000
+BATCH_SIZE = 512
+FLUSH_INTERVAL = 0.2
+
+
+class _Sink:
+    def __init__(self, path, events_path, console):
+        self.file = open(path, 'a')
+        self.events = open(events_path, 'a') if events_path else None
+        self.console = console
+        self.formatter = logging.Formatter(FORMAT)
+
+
+class LogWriter:
+    def __init__(self):
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+        self.reported = 0
+        self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, sink, record):
+        try:
+            self.queue.put_nowait((sink, record))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=1)
+        except queue.Full:
+            return
+        self.thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while batch[-1] is not None and len(batch) < BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            done = batch[-1] is None
+            self._write([item for item in batch if item is not None])
+            if done:
+                return
+
+    def _write(self, batch):
+        lines = {}
+        events = {}
+        console = []
+        for sink, record in batch:
+            try:
+                line = sink.formatter.format(record) + '\n'
+            except Exception:
+                continue
+            lines.setdefault(sink, []).append(line)
+            if sink.console:
+                console.append(line)
+            if sink.events:
+                event = {'ts': round(record.created, 6), 'level': record.levelname,
+                         'logger': record.name, 'msg': record.getMessage()}
+                if hasattr(record, 'event'):
+                    event.update(record.event)
+                events.setdefault(sink, []).append(json.dumps(event, separators=(',', ':')) + '\n')
+
+        if self.dropped != self.reported:
+            console.append(f"log-writer: dropped {self.dropped - self.reported} records (queue full)\n")
+            self.reported = self.dropped
+
+        for sink, chunk in lines.items():
+            self._flush(sink.file, chunk)
+        for sink, chunk in events.items():
+            self._flush(sink.events, chunk)
+        if console:
+            self._flush(sys.stderr, console)
+
+    def _flush(self, stream, chunk):
+        try:
+            stream.write(''.join(chunk))
+            stream.flush()
+        except (OSError, ValueError):
+            pass
+
+
+class AsyncHandler(logging.Handler):
+    def __init__(self, writer, sink):
+        super().__init__()
+        self.writer = writer
+        self.sink = sink
+
+    def emit(self, record):
+        # Resolve a mensagem agora: os argumentos podem mudar até o escritor rodar.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.sink.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        self.writer.submit(self.sink, record)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter()
+        return _writer
+
+
+def setup_logging(name, filename, console=True):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+
+    if not logger.handlers:
+        events_path = None
+        if os.environ.get('LOG_EVENTS', '0') not in ('', '0'):
+            events_path = os.path.join(LOG_DIR, os.path.splitext(filename)[0] + '.events.jsonl')
+        sink = _Sink(os.path.join(LOG_DIR, filename), events_path, console)
+        logger.addHandler(AsyncHandler(get_writer(), sink))
+
+    return logger
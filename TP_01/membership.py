@@ -0,0 +1,94 @@
+import json
+import os
+
+# Composição do cluster: id do nó -> (host, porta), mais os endereços do
+# orquestrador e do print server. Pode vir de um arquivo JSON (--config ou
+# CLUSTER_CONFIG), de uma lista explícita (CLUSTER_NODES="1=node1:5001,...")
+# ou ser gerada a partir de CLUSTER_SIZE com hosts node{id} e portas 5000 + id.
+
+DEFAULT_CLUSTER_SIZE = 6
+DEFAULT_HOST_TEMPLATE = 'node{id}'
+DEFAULT_BASE_PORT = 5000
+DEFAULT_COORDINATOR = ('orquestrador', 5000)
+DEFAULT_PRINT_SERVER = ('print_server', 5001)
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    if not host:
+        raise ValueError(f"Invalid address '{value}', expected host:port")
+    return host, int(port)
+
+
+class Membership:
+    def __init__(self, nodes, coordinator=DEFAULT_COORDINATOR, print_server=DEFAULT_PRINT_SERVER):
+        self.nodes = {int(node_id): (host, int(port)) for node_id, (host, port) in nodes.items()}
+        self.ids = sorted(self.nodes)
+        self.coordinator = (coordinator[0], int(coordinator[1]))
+        self.print_server = (print_server[0], int(print_server[1]))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self.nodes
+
+    def address(self, node_id):
+        return self.nodes[node_id]
+
+    def peers(self, node_id):
+        return {nid: addr for nid, addr in self.nodes.items() if nid != node_id}
+
+    def to_dict(self):
+        return {
+            'nodes': {str(nid): list(addr) for nid, addr in sorted(self.nodes.items())},
+            'orquestrador': list(self.coordinator),
+            'print_server': list(self.print_server),
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def generate(cls, size, host_template=DEFAULT_HOST_TEMPLATE, base_port=DEFAULT_BASE_PORT, **kwargs):
+        nodes = {i: (host_template.format(id=i), base_port + i) for i in range(1, size + 1)}
+        return cls(nodes, **kwargs)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['nodes'],
+                   coordinator=data.get('orquestrador', DEFAULT_COORDINATOR),
+                   print_server=data.get('print_server', DEFAULT_PRINT_SERVER))
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        if environ.get('CLUSTER_CONFIG'):
+            return cls.from_file(environ['CLUSTER_CONFIG'])
+
+        kwargs = {}
+        if environ.get('ORQUESTRADOR_ADDR'):
+            kwargs['coordinator'] = parse_address(environ['ORQUESTRADOR_ADDR'])
+        if environ.get('PRINT_SERVER_ADDR'):
+            kwargs['print_server'] = parse_address(environ['PRINT_SERVER_ADDR'])
+
+        if environ.get('CLUSTER_NODES'):
+            nodes = {}
+            for entry in environ['CLUSTER_NODES'].split(','):
+                node_id, _, address = entry.strip().partition('=')
+                nodes[int(node_id)] = parse_address(address)
+            return cls(nodes, **kwargs)
+
+        return cls.generate(int(environ.get('CLUSTER_SIZE', DEFAULT_CLUSTER_SIZE)),
+                            host_template=environ.get('NODE_HOST_TEMPLATE', DEFAULT_HOST_TEMPLATE),
+                            base_port=int(environ.get('NODE_BASE_PORT', DEFAULT_BASE_PORT)),
+                            **kwargs)
+
+
+def load_membership(path=None):
+    if path:
+        return Membership.from_file(path)
+    return Membership.from_env()
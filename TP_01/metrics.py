@@ -0,0 +1,106 @@
+import json
+import math
+import threading
+import time
+
+# Métricas em memória de cada serviço: contadores, gauges calculados na hora
+# da leitura e histogramas de latência com buckets logarítmicos (4 por
+# potência de 2 a partir de 1us, erro relativo de até ~19%). Um STATS recebido
+# na porta do serviço devolve o snapshot em JSON no payload do STATS_REPLY;
+# stats.py faz a consulta pela linha de comando.
+
+HISTOGRAM_BASE = 1e-6
+BUCKETS_PER_OCTAVE = 4
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, p):
+    # Percentil exato de uma lista de amostras (simulator.py, benchmark.py); o
+    # Histogram abaixo só guarda os buckets e calcula o seu aproximado.
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value):
+        bucket = 0 if value <= HISTOGRAM_BASE else math.ceil(math.log2(value / HISTOGRAM_BASE) * BUCKETS_PER_OCTAVE)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        # Limite superior do bucket que contém o percentil, limitado pelo máximo visto.
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(HISTOGRAM_BASE * 2 ** (bucket / BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def snapshot(self):
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'min': self.min if self.count else 0.0,
+            'max': self.max,
+        }
+        for p in PERCENTILES:
+            summary[f'p{p}'] = self.percentile(p)
+        return summary
+
+
+class Metrics:
+    def __init__(self, service):
+        self.service = service
+        self.started = time.monotonic()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def snapshot(self):
+        gauges = {}
+        for name, read in list(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception:
+                gauges[name] = None
+        with self.lock:
+            return {
+                'service': self.service,
+                'uptime': time.monotonic() - self.started,
+                'counters': dict(self.counters),
+                'gauges': gauges,
+                'histograms': {name: h.snapshot() for name, h in self.histograms.items()},
+            }
+
+    def encode(self):
+        return json.dumps(self.snapshot(), separators=(',', ':')).encode()
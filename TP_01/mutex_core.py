@@ -0,0 +1,783 @@
+import heapq
+import math
+from collections import deque, namedtuple
+from codec import (Message, REQUEST, REPLY, LOCKED, RELEASE, INQUIRE, RELINQUISH, FAILED,
+                   TOKEN, TOKEN_QUERY, TOKEN_STATUS, encode_token, decode_token)
+
+# Núcleo dos algoritmos de exclusão mútua, sem sockets, threads nem relógio:
+# cada evento (pedido local, mensagem recebida, falha de envio, timer vencido,
+# saída da CS) devolve a lista de efeitos que o chamador deve executar:
+#   Send(dest, message)   enviar a mensagem ao nó dest (pode ser o próprio nó)
+#   Timer(delay, name, key) chamar timer(name, key) daqui a delay segundos
+#   Enter(clock)          o nó obteve a exclusão mútua e entra na CS
+# Timers não são cancelados: o núcleo ignora os que já não valem (pela key).
+# peer_down/peer_up vêm do detector de falhas: um nó suspeito é tratado como
+# fora do cluster (não se espera resposta dele) até voltar a ser ouvido.
+# distributed_node.py liga os núcleos à rede e simulator.py a uma rede simulada.
+
+Send = namedtuple('Send', 'dest message')
+Timer = namedtuple('Timer', 'delay name key')
+Enter = namedtuple('Enter', 'clock')
+
+
+class _NullLogger:
+    def info(self, *args, **kwargs):
+        pass
+
+    warning = error = debug = info
+
+
+NULL_LOGGER = _NullLogger()
+
+
+class RequestQueue:
+    # Pedidos pendentes em heap por (timestamp, id). Cada nó tem no máximo um
+    # pedido vivo; entradas substituídas ou removidas são descartadas ao chegar ao topo.
+
+    def __init__(self):
+        self.heap = []
+        self.live = {}
+
+    def __len__(self):
+        return len(self.live)
+
+    def __contains__(self, node_id):
+        return node_id in self.live
+
+    def push(self, ts, node_id):
+        self.live[node_id] = ts
+        heapq.heappush(self.heap, (ts, node_id))
+        if len(self.heap) > 2 * len(self.live) + 64:
+            self.heap = [(t, n) for n, t in self.live.items()]
+            heapq.heapify(self.heap)
+
+    def discard(self, node_id):
+        self.live.pop(node_id, None)
+
+    def peek(self):
+        while self.heap and self.live.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def pop(self):
+        head = self.peek()
+        if head is not None:
+            heapq.heappop(self.heap)
+            del self.live[head[1]]
+        return head
+
+    def items(self):
+        return [(ts, node_id) for node_id, ts in self.live.items()]
+
+
+def grid_quorum(node_ids, node_id):
+    # Quórum de Maekawa em grade: os nós ficam em uma grade de lado ceil(sqrt(N))
+    # e o quórum é a linha mais a coluna do nó. Duas linhas+colunas sempre se cruzam.
+    ordered = sorted(node_ids)
+    side = math.ceil(math.sqrt(len(ordered)))
+    row, col = divmod(ordered.index(node_id), side)
+    quorum = set(ordered[row * side:(row + 1) * side])
+    quorum.update(ordered[col::side])
+    return quorum
+
+
+class MutexCore:
+    # Estado comum: relógio de Lamport e as flags do pedido. node_ids é a lista
+    # ordenada de ids do cluster, compartilhada entre os núcleos e não copiada.
+
+    def __init__(self, node_id, node_ids, logger=None):
+        self.node_id = node_id
+        self.node_ids = node_ids
+        self.logger = logger or NULL_LOGGER
+        self.clock = 0
+        self.request_ts = 0
+        self.requesting = False
+        self.in_cs = False
+        self.down = set()
+        self.handlers = {}
+
+    def peers(self):
+        return (node_id for node_id in self.node_ids if node_id != self.node_id)
+
+    def event(self, kind, **fields):
+        # campos estruturados do log de eventos (logutil, LOG_EVENTS=1)
+        return {'event': {'event': kind, 'node': self.node_id, **fields}}
+
+    def gauges(self):
+        return {}
+
+    def request(self):
+        raise NotImplementedError
+
+    def receive(self, message):
+        handler = self.handlers.get(message.kind)
+        if handler is None:
+            self.logger.warning(f"Unexpected message {message}")
+            return []
+        effects = []
+        handler(message, effects)
+        return effects
+
+    def release(self):
+        if not self.in_cs:
+            return []
+        self.in_cs = False
+        self.requesting = False
+        effects = []
+        self.release_permissions(effects)
+        return effects
+
+    def release_permissions(self, effects):
+        pass
+
+    def peer_failed(self, node_id, message):
+        return []
+
+    def peer_down(self, node_id):
+        self.down.add(node_id)
+        effects = []
+        self.forget(node_id, effects)
+        return effects
+
+    def peer_up(self, node_id):
+        self.down.discard(node_id)
+        return []
+
+    def forget(self, node_id, effects):
+        pass
+
+    def timer(self, name, key):
+        return []
+
+    def enter(self, effects):
+        if not self.in_cs:
+            self.in_cs = True
+            effects.append(Enter(self.clock))
+
+    def update_clock(self, received_ts):
+        self.clock = max(self.clock, received_ts) + 1
+
+
+class CentralCore(MutexCore):
+    # Sem protocolo entre os nós: a exclusão é do orquestrador, então o pedido
+    # é concedido localmente na hora e o nó vai direto pedir o recurso.
+
+    def request(self):
+        if self.requesting:
+            return []
+        self.clock += 1
+        self.request_ts = self.clock
+        self.requesting = True
+        effects = []
+        self.enter(effects)
+        return effects
+
+
+class RicartAgrawala(MutexCore):
+    # Ricart-Agrawala: pede permissão a todos os outros nós, 2(N-1) mensagens por entrada.
+    # Com reuse_permissions (otimização de Roucairol-Carvalho) o nó guarda as
+    # permissões recebidas e só as devolve quando o dono pede, então entradas
+    # repetidas só perguntam a quem pediu a CS desde a última vez.
+
+    def __init__(self, node_id, node_ids, reuse_permissions=True, logger=None):
+        super().__init__(node_id, node_ids, logger)
+        self.reuse_permissions = reuse_permissions
+        self.size = len(node_ids) - 1
+        self.deferred = set()
+        self.awaiting_replies_from = set()
+        self.permissions = set()
+        self.handlers = {
+            REQUEST: self.handle_request,
+            REPLY: self.handle_reply,
+        }
+
+    def gauges(self):
+        return {
+            'replies_outstanding': lambda: len(self.awaiting_replies_from),
+            'deferred': lambda: len(self.deferred),
+        }
+
+    def request(self):
+        if self.requesting:
+            return []  # já solicitando
+
+        self.clock += 1
+        self.request_ts = self.clock
+        self.requesting = True
+        permissions, down = self.permissions, self.down
+        self.awaiting_replies_from = {node_id for node_id in self.peers()
+                                      if node_id not in permissions and node_id not in down}
+        self.logger.info(f"Requesting CS with timestamp {self.request_ts} "
+                         f"({self.size - len(self.awaiting_replies_from)} permissions reused)",
+                         extra=self.event('request', clock=self.request_ts))
+
+        message = Message(REQUEST, self.node_id, self.request_ts)
+        effects = [Send(node_id, message) for node_id in self.awaiting_replies_from]
+        if not self.awaiting_replies_from:
+            self.enter(effects)
+        return effects
+
+    def handle_request(self, message, effects):
+        ts, node_id = message.clock, message.sender
+        self.update_clock(ts)
+        if not self.in_cs and (not self.requesting or self.should_grant(ts, node_id)):
+            self.send_reply(node_id, effects)
+            self.logger.info(f"Granted access to Node {node_id}", extra=self.event('grant', peer=node_id, clock=ts))
+            if self.requesting and node_id not in self.awaiting_replies_from:
+                # a permissão reaproveitada foi entregue: é preciso pedi-la de novo
+                self.awaiting_replies_from.add(node_id)
+                effects.append(Send(node_id, Message(REQUEST, self.node_id, self.request_ts)))
+        else:
+            self.deferred.add(node_id)
+            self.logger.info(f"Deferred Node {node_id}", extra=self.event('defer', peer=node_id, clock=ts))
+
+    def handle_reply(self, message, effects):
+        node_id = message.sender
+        self.update_clock(message.clock)
+        if self.reuse_permissions:
+            self.permissions.add(node_id)
+        if node_id in self.awaiting_replies_from:
+            self.awaiting_replies_from.remove(node_id)
+            self.logger.info(f"Received REPLY from Node {node_id} "
+                             f"({self.size - len(self.awaiting_replies_from)}/{self.size})",
+                             extra=self.event('granted', peer=node_id, clock=self.request_ts))
+        if self.requesting and not self.awaiting_replies_from:
+            self.enter(effects)
+
+    def peer_failed(self, node_id, message):
+        # Nó inalcançável é tratado como fora do cluster: não espera mais a resposta dele.
+        effects = []
+        if message.kind == REQUEST:
+            self.stop_waiting(node_id, effects)
+        return effects
+
+    def forget(self, node_id, effects):
+        self.deferred.discard(node_id)
+        self.stop_waiting(node_id, effects)
+
+    def stop_waiting(self, node_id, effects):
+        if node_id in self.awaiting_replies_from:
+            self.awaiting_replies_from.remove(node_id)
+            if self.requesting and not self.awaiting_replies_from:
+                self.enter(effects)
+
+    def release_permissions(self, effects):
+        self.awaiting_replies_from.clear()
+        deferred = list(self.deferred)
+        self.deferred.clear()
+        for node_id in deferred:
+            self.send_reply(node_id, effects)
+
+    def send_reply(self, node_id, effects):
+        self.permissions.discard(node_id)
+        effects.append(Send(node_id, Message(REPLY, self.node_id, self.clock)))
+
+    def should_grant(self, ts, node_id):
+        # Compara com o timestamp do próprio pedido, não com o relógio atual,
+        # que já avançou com as mensagens recebidas desde então.
+        return (ts, node_id) < (self.request_ts, self.node_id)
+
+
+class Maekawa(MutexCore):
+    # Maekawa com quóruns em grade (~2*sqrt(N) nós). Cada nó também é árbitro:
+    # concede um único voto (LOCKED) por vez e usa INQUIRE/RELINQUISH/FAILED
+    # para desfazer votos quando um pedido mais antigo chega, evitando deadlock.
+    # Um árbitro suspeito nunca conta como voto: dois quóruns da grade podem ter só
+    # ele em comum. O pedido refaz o quórum com a linha e a coluna mais próximas que
+    # não têm suspeitos; qualquer linha+coluna cruza qualquer outra linha+coluna, então
+    # o novo quórum ainda cruza o de todos os outros nós em um árbitro fora de suspeita.
+    # Sem linha ou coluna livre, o pedido espera um suspeito voltar.
+    # Um pedido sem todos os votos após retry_timeout é reenviado aos árbitros que
+    # faltam: sem detector de falhas é o que revela um árbitro que caiu depois de
+    # receber o pedido (o reenvio falha e o quórum é refeito) ou um dono de voto que
+    # caiu (o árbitro o sonda com INQUIRE e, se o envio falhar, libera o voto).
+
+    def __init__(self, node_id, node_ids, quorum=None, logger=None, retry_timeout=5):
+        super().__init__(node_id, node_ids, logger)
+        self.retry_timeout = retry_timeout
+        self.grid = quorum is None
+        self.home_quorum = quorum if quorum is not None else grid_quorum(node_ids, node_id)
+        # lado solicitante; quorum é o quórum do pedido atual (vazio: pedido bloqueado)
+        self.quorum = self.home_quorum
+        self.votes = set()
+        self.failed = False
+        self.inquiries = set()
+        self.unreachable = set()
+        # lado árbitro
+        self.locked_for = None
+        self.inquired = False
+        self.waiting = RequestQueue()
+        self.failed_sent = set()
+        self.handlers = {
+            REQUEST: self.handle_request,
+            LOCKED: self.handle_locked,
+            FAILED: self.handle_failed,
+            INQUIRE: self.handle_inquire,
+            RELINQUISH: self.handle_relinquish,
+            RELEASE: self.handle_release,
+        }
+
+    def gauges(self):
+        return {
+            'replies_outstanding': lambda: len(self.quorum - self.votes) if self.requesting else 0,
+            'arbiter_queue': lambda: len(self.waiting),
+        }
+
+    def request(self):
+        if self.requesting:
+            return []  # já solicitando
+
+        self.clock += 1
+        self.request_ts = self.clock
+        self.requesting = True
+        self.votes = set()
+        self.failed = False
+        self.inquiries = set()
+        self.quorum = set()
+        effects = [Timer(self.retry_timeout, 'retry', self.request_ts)]
+        self.reform(effects)
+        if self.quorum:
+            self.logger.info(f"Requesting CS with timestamp {self.request_ts} from quorum {sorted(self.quorum)}",
+                             extra=self.event('request', clock=self.request_ts, quorum=sorted(self.quorum)))
+        return effects
+
+    def timer(self, name, key):
+        effects = []
+        if name != 'retry' or not self.requesting or self.in_cs or key != self.request_ts:
+            return effects
+        effects.append(Timer(self.retry_timeout, 'retry', key))
+        if not self.quorum:
+            self.reform(effects)
+            return effects
+        missing = self.quorum - self.votes
+        self.logger.info(f"Still waiting for votes of {sorted(missing)}, resending request")
+        request = Message(REQUEST, self.node_id, self.request_ts)
+        effects.extend(Send(node_id, request) for node_id in missing)
+        return effects
+
+    def receive(self, message):
+        self.unreachable.discard(message.sender)
+        return super().receive(message)
+
+    def peer_failed(self, node_id, message):
+        # REQUEST não entregue: o árbitro fica fora dos quóruns (nunca vira voto) até
+        # ser ouvido de novo. LOCKED não entregue: o voto não saiu, então volta para
+        # este árbitro e vai para o próximo da fila, como o token no Suzuki-Kasami.
+        # INQUIRE não entregue: o dono do voto caiu, e o voto é liberado do mesmo jeito.
+        effects = []
+        if message.kind == REQUEST:
+            self.unreachable.add(node_id)
+            if self.requesting and not self.in_cs and message.clock == self.request_ts and node_id in self.quorum:
+                self.reform(effects)
+        elif message.kind in (LOCKED, INQUIRE) and self.locked_for == (message.clock, node_id):
+            self.locked_for = None
+            self.waiting.discard(node_id)
+            head = self.waiting.pop()
+            if head is not None:
+                self.grant_vote(*head, effects)
+            self.arbitrate(effects)
+        return effects
+
+    def peer_up(self, node_id):
+        effects = super().peer_up(node_id)
+        if self.requesting and not self.in_cs and not self.quorum:
+            self.reform(effects)
+        return effects
+
+    def forget(self, node_id, effects):
+        # Como solicitante, um árbitro suspeito tira o pedido do quórum atual; como
+        # árbitro, o voto preso com o suspeito e o pedido dele na fila são liberados.
+        self.inquiries.discard(node_id)
+        if self.requesting and not self.in_cs and node_id in self.quorum:
+            self.reform(effects)
+        if self.locked_for is not None and self.locked_for[1] == node_id:
+            self.locked_for = None
+            self.waiting.discard(node_id)
+            head = self.waiting.pop()
+            if head is not None:
+                self.grant_vote(*head, effects)
+        else:
+            self.waiting.discard(node_id)
+        self.arbitrate(effects)
+
+    def excluded(self):
+        return self.down | self.unreachable
+
+    def choose_quorum(self):
+        # Quórum atual, o da grade do nó ou a linha+coluna livre mais próxima; None se não houver
+        excluded = self.excluded()
+        if self.quorum and not self.quorum & excluded:
+            return self.quorum
+        if not self.home_quorum & excluded:
+            return self.home_quorum
+        if not self.grid:
+            return None
+        ordered = self.node_ids
+        side = math.ceil(math.sqrt(len(ordered)))
+        row, col = divmod(ordered.index(self.node_id), side)
+        rows = [ordered[r * side:(r + 1) * side] for r in range((len(ordered) + side - 1) // side)]
+        cols = [ordered[c::side] for c in range(side)]
+
+        def nearest(lines, home):
+            for index in sorted(range(len(lines)), key=lambda index: abs(index - home)):
+                if lines[index] and not excluded.intersection(lines[index]):
+                    return lines[index]
+            return None
+
+        free_row, free_col = nearest(rows, row), nearest(cols, col)
+        if free_row is None or free_col is None:
+            return None
+        return set(free_row) | set(free_col)
+
+    def reform(self, effects):
+        quorum = self.choose_quorum()
+        if quorum is None:
+            if self.quorum:
+                self.logger.warning("No quorum free of suspected nodes, request waits for one to recover")
+            quorum = set()
+        elif quorum != self.quorum and self.quorum:
+            self.logger.info(f"Re-forming quorum without suspected nodes: {sorted(quorum)}")
+        self.use_quorum(quorum, effects)
+
+    def use_quorum(self, quorum, effects):
+        # Devolve votos e pedidos dos árbitros que saíram e pede aos que entraram
+        dropped, added = self.quorum - quorum, quorum - self.quorum
+        self.quorum = quorum
+        release = Message(RELEASE, self.node_id, self.request_ts)
+        for node_id in dropped:
+            self.votes.discard(node_id)
+            self.inquiries.discard(node_id)
+            effects.append(Send(node_id, release))
+        request = Message(REQUEST, self.node_id, self.request_ts)
+        effects.extend(Send(node_id, request) for node_id in added)
+        if quorum and quorum <= self.votes:
+            self.enter(effects)
+
+    # --- lado solicitante ---
+
+    def handle_locked(self, message, effects):
+        self.update_clock(message.clock)
+        if not self.requesting or message.clock != self.request_ts or message.sender not in self.quorum:
+            # voto de um pedido que já terminou ou de um árbitro que saiu do quórum:
+            # devolve para não prender o árbitro
+            effects.append(Send(message.sender, Message(RELEASE, self.node_id, message.clock)))
+            return
+        self.add_vote(message.sender, effects)
+
+    def add_vote(self, node_id, effects):
+        self.votes.add(node_id)
+        self.logger.info(f"Received vote from Node {node_id} ({len(self.votes & self.quorum)}/{len(self.quorum)})",
+                         extra=self.event('granted', peer=node_id, clock=self.request_ts))
+        if self.quorum and self.quorum <= self.votes:
+            self.enter(effects)
+
+    def handle_failed(self, message, effects):
+        self.update_clock(message.clock)
+        if not self.requesting or message.clock != self.request_ts or message.sender not in self.quorum:
+            return
+        self.failed = True
+        for arbiter in self.inquiries:
+            self.relinquish(arbiter, effects)
+        self.inquiries.clear()
+
+    def handle_inquire(self, message, effects):
+        self.update_clock(message.clock)
+        if not self.requesting or message.clock != self.request_ts or self.in_cs:
+            return
+        if message.sender not in self.votes:
+            return
+        if self.failed:
+            self.relinquish(message.sender, effects)
+        else:
+            self.inquiries.add(message.sender)
+
+    def relinquish(self, arbiter, effects):
+        self.votes.discard(arbiter)
+        self.logger.info(f"Relinquishing vote of Node {arbiter}",
+                         extra=self.event('relinquish', peer=arbiter, clock=self.request_ts))
+        effects.append(Send(arbiter, Message(RELINQUISH, self.node_id, self.request_ts)))
+
+    def release_permissions(self, effects):
+        self.votes = set()
+        self.inquiries.clear()
+        message = Message(RELEASE, self.node_id, self.request_ts)
+        effects.extend(Send(node_id, message) for node_id in self.quorum)
+
+    # --- lado árbitro ---
+
+    def handle_request(self, message, effects):
+        ts, node_id = message.clock, message.sender
+        self.update_clock(ts)
+        if self.locked_for == (ts, node_id):
+            return  # pedido reenviado que já tem o voto
+        if self.waiting.live.get(node_id) == ts:
+            # pedido reenviado ainda na fila: sonda o dono do voto, que pode ter caído
+            effects.append(Send(self.locked_for[1], Message(INQUIRE, self.node_id, self.locked_for[0])))
+            return
+        if self.locked_for is None:
+            self.grant_vote(ts, node_id, effects)
+        else:
+            self.waiting.push(ts, node_id)
+            self.logger.info(f"Queued request of Node {node_id}, vote held by Node {self.locked_for[1]}")
+        self.arbitrate(effects)
+
+    def handle_relinquish(self, message, effects):
+        self.update_clock(message.clock)
+        if self.locked_for != (message.clock, message.sender):
+            return
+        self.waiting.push(*self.locked_for)
+        self.locked_for = None
+        self.grant_vote(*self.waiting.pop(), effects)
+        self.arbitrate(effects)
+
+    def handle_release(self, message, effects):
+        self.update_clock(message.clock)
+        if self.locked_for != (message.clock, message.sender):
+            if self.waiting.live.get(message.sender) == message.clock:
+                self.waiting.discard(message.sender)
+                self.arbitrate(effects)
+            return
+        self.locked_for = None
+        head = self.waiting.pop()
+        if head is not None:
+            self.grant_vote(*head, effects)
+        self.arbitrate(effects)
+
+    def grant_vote(self, ts, node_id, effects):
+        self.locked_for = (ts, node_id)
+        self.inquired = False
+        self.logger.info(f"Voted for Node {node_id}", extra=self.event('grant', peer=node_id, clock=ts))
+        effects.append(Send(node_id, Message(LOCKED, self.node_id, ts)))
+
+    def arbitrate(self, effects):
+        # Todo pedido na fila que não é o mais prioritário de todos recebe FAILED;
+        # se o mais prioritário é mais antigo que o voto atual, o dono do voto recebe INQUIRE.
+        if self.locked_for is None:
+            return
+        best = self.waiting.peek()
+        if best is not None and best < self.locked_for and not self.inquired:
+            self.inquired = True
+            effects.append(Send(self.locked_for[1], Message(INQUIRE, self.node_id, self.locked_for[0])))
+        pending = self.waiting.items()
+        self.failed_sent.intersection_update(pending)
+        for request in pending:
+            if request in self.failed_sent or (request == best and best < self.locked_for):
+                continue
+            self.failed_sent.add(request)
+            effects.append(Send(request[1], Message(FAILED, self.node_id, request[0])))
+
+
+class SuzukiKasami(MutexCore):
+    # Suzuki-Kasami: quem tem o token entra sem trocar mensagens; os demais
+    # difundem REQUEST com o número de sequência (RN) e o token carrega LN e a
+    # fila de espera. Entrada custa 0 mensagens com o token e no máximo N sem ele.
+    # RN e LN só guardam ids com valor diferente de zero.
+    GENERATION_STRIDE = 1 << 20
+
+    def __init__(self, node_id, node_ids, token_timeout=15, probe_timeout=2, logger=None):
+        super().__init__(node_id, node_ids, logger)
+        self.token_timeout = token_timeout
+        self.probe_timeout = probe_timeout
+        self.rn = {}
+        self.has_token = node_id == node_ids[0]
+        self.ln = {}
+        self.token_queue = deque()
+        self.generation = 0
+        self.token_timer = 0
+        self.probe = None
+        self.handlers = {
+            REQUEST: self.handle_request,
+            TOKEN: self.handle_token,
+            TOKEN_QUERY: self.handle_token_query,
+            TOKEN_STATUS: self.handle_token_status,
+        }
+
+    def gauges(self):
+        return {
+            'token_queue': lambda: len(self.token_queue),
+            'has_token': lambda: int(self.has_token),
+        }
+
+    def request(self):
+        if self.requesting:
+            return []  # já solicitando
+
+        self.clock += 1
+        self.requesting = True
+        effects = []
+        if self.has_token:
+            self.logger.info("Requesting CS while holding the token", extra=self.event('request', clock=self.clock))
+            self.enter(effects)
+            return effects
+
+        self.rn[self.node_id] = self.rn.get(self.node_id, 0) + 1
+        self.logger.info(f"Requesting CS with sequence number {self.rn[self.node_id]}",
+                         extra=self.event('request', clock=self.clock, sn=self.rn[self.node_id]))
+        self.broadcast_request(effects)
+        return effects
+
+    def broadcast_request(self, effects):
+        message = Message(REQUEST, self.node_id, self.clock, self.rn[self.node_id])
+        effects.extend(Send(node_id, message) for node_id in self.peers())
+        self.arm_token_timer(effects)
+
+    def arm_token_timer(self, effects):
+        # Rearmar invalida o timer anterior: só o de key igual a token_timer vale.
+        self.token_timer += 1
+        effects.append(Timer(self.token_timeout, 'token', self.token_timer))
+
+    def handle_request(self, message, effects):
+        node_id, sn = message.sender, message.value
+        self.update_clock(message.clock)
+        self.rn[node_id] = max(self.rn.get(node_id, 0), sn)
+        if self.has_token and not self.in_cs and self.rn[node_id] == self.ln.get(node_id, 0) + 1:
+            self.token_queue.append(node_id)
+            self.pass_token(effects)
+
+    def handle_token(self, message, effects):
+        self.update_clock(message.clock)
+        if message.value < self.generation:
+            self.logger.warning(f"Discarding stale token of generation {message.value} from Node {message.sender}")
+            return
+        self.generation = message.value
+        self.has_token = True
+        ln, queue = decode_token(message.payload)
+        self.ln = ln
+        self.token_queue = deque(queue)
+        self.token_timer += 1
+        self.probe = None
+        self.logger.info(f"Received token from Node {message.sender}",
+                         extra=self.event('granted', peer=message.sender, generation=message.value))
+        if self.requesting:
+            self.enter(effects)
+        else:
+            self.release_permissions(effects)
+
+    def release_permissions(self, effects):
+        served = self.rn.get(self.node_id, 0)
+        if served:
+            self.ln[self.node_id] = served
+        queued = set(self.token_queue)
+        ln = self.ln
+        for node_id, sn in self.rn.items():
+            if node_id not in queued and sn == ln.get(node_id, 0) + 1:
+                self.token_queue.append(node_id)
+        self.pass_token(effects)
+
+    def pass_token(self, effects):
+        # nós suspeitos perdem a vez, como um nó inalcançável em peer_failed
+        while self.token_queue and self.token_queue[0] in self.down:
+            skipped = self.token_queue.popleft()
+            self.ln[skipped] = self.rn.get(skipped, 0)
+        if not self.token_queue:
+            return
+        node_id = self.token_queue.popleft()
+        if node_id == self.node_id:
+            return
+        self.has_token = False
+        self.logger.info(f"Passing token to Node {node_id}",
+                         extra=self.event('grant', peer=node_id, generation=self.generation))
+        effects.append(Send(node_id, Message(TOKEN, self.node_id, self.clock, self.generation,
+                                             encode_token(self.ln, self.token_queue))))
+
+    def peer_failed(self, node_id, message):
+        # O token não saiu: retoma a posse e pula o nó inalcançável.
+        effects = []
+        if message.kind != TOKEN or message.value < self.generation:
+            return effects
+        self.has_token = True
+        self.ln, queue = decode_token(message.payload)
+        self.ln[node_id] = self.rn.get(node_id, 0)
+        self.token_queue = deque(queue)
+        if self.requesting and not self.in_cs:
+            self.enter(effects)
+        else:
+            self.pass_token(effects)
+        return effects
+
+    def forget(self, node_id, effects):
+        # Com o token, o suspeito sai da fila; esperando o token, o suspeito pode
+        # ser o dono, então a consulta de regeneração começa sem esperar o timeout.
+        if self.has_token:
+            if not self.in_cs:
+                self.pass_token(effects)
+        elif self.requesting and not self.probe:
+            self.on_token_timeout(effects)
+
+    def timer(self, name, key):
+        effects = []
+        if name == 'token' and key == self.token_timer:
+            self.on_token_timeout(effects)
+        elif name == 'probe':
+            self.finish_probe(key, effects)
+        return effects
+
+    # --- regeneração do token ---
+    #
+    # Se um pedido espera mais que token_timeout, o nó propõe uma nova geração
+    # (única por nó) e pergunta a todos se alguém tem o token. Quem não tem
+    # adota a nova geração, então um token antigo ainda em trânsito é descartado
+    # ao chegar. Sem nenhum dono vivo, o token é recriado com LN montado a partir
+    # dos pedidos pendentes informados nas respostas.
+
+    def on_token_timeout(self, effects):
+        if not self.requesting or self.has_token:
+            return
+        base = max(self.generation, self.probe['generation'] if self.probe else 0)
+        generation = (base // self.GENERATION_STRIDE + 1) * self.GENERATION_STRIDE + self.node_id
+        self.probe = {'generation': generation, 'replies': {}, 'alive': False}
+        self.logger.warning(f"No token, probing for token (generation {generation})")
+        message = Message(TOKEN_QUERY, self.node_id, self.clock, generation)
+        effects.extend(Send(node_id, message) for node_id in self.peers())
+        effects.append(Timer(self.probe_timeout, 'probe', generation))
+
+    def handle_token_query(self, message, effects):
+        self.update_clock(message.clock)
+        # Quem tem o token também adota a geração proposta: o token vivo passa
+        # a carregá-la e não é descartado pelos nós que já a adotaram.
+        self.generation = max(self.generation, message.value)
+        if self.has_token:
+            status = -1
+        else:
+            status = self.rn.get(self.node_id, 0) if self.requesting else 0
+        if self.probe and message.value > self.probe['generation']:
+            self.probe = None  # outra proposta maior vence
+            self.arm_token_timer(effects)
+        effects.append(Send(message.sender, Message(TOKEN_STATUS, self.node_id, message.value, status)))
+
+    def handle_token_status(self, message, effects):
+        # Aqui o campo clock carrega a geração consultada, não o relógio de Lamport.
+        if not self.probe or message.clock != self.probe['generation']:
+            return
+        if message.value < 0:
+            self.probe['alive'] = True
+        else:
+            self.probe['replies'][message.sender] = message.value
+        # todos os nós não suspeitos responderam (ou o dono apareceu): conclui já
+        if self.probe['alive'] or len(self.probe['replies']) >= len(self.node_ids) - 1 - len(self.down):
+            self.finish_probe(message.clock, effects)
+
+    def finish_probe(self, generation, effects):
+        probe = self.probe
+        if not probe or probe['generation'] != generation:
+            return
+        self.probe = None
+        if self.has_token or not self.requesting:
+            return
+        if probe['alive'] or generation < self.generation:
+            self.generation = max(self.generation, generation)
+            self.logger.info("Token is alive, re-sending request")
+            self.broadcast_request(effects)
+            return
+
+        ln = {node_id: sn for node_id, sn in self.rn.items() if sn}
+        for node_id, outstanding in probe['replies'].items():
+            if outstanding > 0:
+                self.rn[node_id] = max(self.rn.get(node_id, 0), outstanding)
+                ln[node_id] = outstanding - 1
+        self.generation = generation
+        self.has_token = True
+        self.ln = ln
+        self.token_queue = deque()
+        self.logger.warning(f"Regenerated token (generation {generation})")
+        self.enter(effects)
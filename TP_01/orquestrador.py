@@ -1,106 +1,275 @@
-import socket
+import argparse
+import itertools
 import threading
-import logging
-import os
+import time
+from collections import deque
+from codec import (Message, ENTER, ENTER_OK, ENTER_DENIED, EXIT, EXIT_OK, START, DONE, STOP,
+                   MODE_EXCLUSIVE, MODE_SHARED, DEFAULT_RESOURCE, STATS, STATS_REPLY)
+from failure_detector import FailureDetector
+import logutil
+from membership import load_membership
+from metrics import Metrics
+from runtime import ENGINES, ThreadRuntime, make_runtime
 
 
 def setup_logging():
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-    
-    logger = logging.getLogger('Orquestrador')
-    logger.setLevel(logging.INFO)
-
-    if not logger.handlers:
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler = logging.FileHandler('logs/orquestrador.log')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-
-    return logger
+    return logutil.setup_logging('Orquestrador', 'orquestrador.log')
+
+class Grant:
+    def __init__(self, node_id, clock, mode, channel):
+        self.node_id = node_id
+        self.clock = clock
+        self.mode = mode
+        self.channel = channel
+        self.requested = time.monotonic()
+        self.granted = None
+        self.job = 0
+        self.printing = False
+        self.timer = None
+
+class Resource:
+    # Um recurso nomeado com seus donos atuais e a fila FIFO de espera. Vários
+    # donos só coexistem em modo compartilhado (leitores); o exclusivo é único.
+
+    def __init__(self, name):
+        self.name = name
+        self.holders = {}
+        self.waiters = deque()
+        self.last_printed_number = 0
+
+    def holder_ids(self):
+        return ', '.join(str(g.node_id) for g in self.holders.values())
+
+    def compatible(self, grant):
+        if not self.holders:
+            return True
+        return grant.mode == MODE_SHARED and all(g.mode == MODE_SHARED for g in self.holders.values())
+
+    def exclusive_holder(self):
+        for grant in self.holders.values():
+            if grant.mode == MODE_EXCLUSIVE:
+                return grant
+        return None
 
 class Orquestrador:
-    def __init__(self):
+    # A entrada na CS não espera o print server: o ENTER_OK sai assim que o lock
+    # é concedido e o START segue pela conexão persistente com um id de job. O
+    # DONE correspondente é repassado ao nó, que só então manda EXIT. Dentro do
+    # lock as mensagens só são enfileiradas em `sends`; o envio acontece depois.
+    # Cada concessão é um lease de LEASE_TIME segundos (informado em ms no campo
+    # clock do ENTER_OK), renovado por qualquer mensagem do dono; sem renovação o
+    # orquestrador revoga sozinho, sem esperar o EXIT_TIMEOUT nem a queda do socket.
+    EXIT_TIMEOUT = 10
+    LEASE_TIME = 1.0
+
+    def __init__(self, runtime=None, membership=None):
         self.logger = setup_logging()
-        self.current_user = None
+        self.runtime = runtime or ThreadRuntime(self.logger)
+        self.membership = membership or load_membership()
+        self.resources = {}
         self.lock = threading.Lock()
+        self.metrics = Metrics('orquestrador')
+        self.metrics.gauge('holders', lambda: sum(len(r.holders) for r in list(self.resources.values())))
+        self.metrics.gauge('waiters', lambda: sum(len(r.waiters) for r in list(self.resources.values())))
         self.last_timestamp = 0
-        self.last_printed_number = 0
-        self.numbers_socket_lock = threading.Lock()
-
-    def notify_numbers_service(self, message):
-        with self.numbers_socket_lock:
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(10)
-                    s.connect(("print_server", 5001))
-                    s.sendall(message.encode())
-                    if message.startswith("START"):
-                        response = s.recv(1024).decode().strip()
-                        if response.startswith("DONE"):
-                            _, last_num = response.split(":")
-                            self.last_printed_number = int(last_num)
-            except Exception as e:
-                self.logger.error(f"Failed to notify numbers service: {e}")
-
-
-    def handle_client(self, conn, addr):
-        with conn:
-            try:
-                conn.settimeout(10)
-                data = conn.recv(1024).decode().strip()
-
-                if data.startswith("ENTER:"):
-                    parts = data.split(":")
-                    node_id = parts[1].strip()
-                    node_clock = int(parts[2]) if len(parts) > 2 else 0
-                    with self.lock:
-                        if self.current_user is not None:
-                            self.logger.warning(f"CS conflict: Node {node_id} tried to enter but current user is {self.current_user}")
-                            msg = f"{self.current_user} is in CS".encode()
-                            conn.sendall(msg)
-                            return
-
-                        self.current_user = node_id
-                        self.logger.info(f"ENTER - Node {node_id}")
-
-                        self.notify_numbers_service(f"START:{node_id}:{self.last_printed_number}:{node_clock}")
-                        conn.sendall(b"ENTER_OK")
-
-                    try:
-                        exit_msg = conn.recv(1024).decode().strip()
-                        if exit_msg == "EXIT":
-                            with self.lock:
-                                self.current_user = None
-                                self.logger.info(f"EXIT - Node {node_id}")
-                                self.last_timestamp += 10
-                            conn.sendall(b"EXIT_OK")
-                    except socket.timeout:
-                        self.logger.error(f"Timeout waiting for EXIT from Node {node_id}")
-                        with self.lock:
-                            self.current_user = None
-                            self.notify_numbers_service("STOP")
-
-            except Exception as e:
-                self.logger.error(f"ERROR - {e}")
-                with self.lock:
-                    if self.current_user:
-                        self.current_user = None
-                        self.notify_numbers_service("STOP")
+        self.jobs = itertools.count(1)
+        self.leases = FailureDetector(self.runtime, self.LEASE_TIME, self.on_lease_expired)
+        self.numbers_service = self.runtime.connect(*self.membership.print_server,
+                                                    on_message=self.handle_numbers_message,
+                                                    on_failure=self.on_numbers_failure)
+
+    def resource(self, name):
+        resource = self.resources.get(name)
+        if resource is None:
+            resource = self.resources[name] = Resource(name)
+        return resource
+
+    def flush(self, sends):
+        for channel, message in sends:
+            channel.send(message)
+
+    def handle_numbers_message(self, channel, response):
+        # No DONE o campo clock carrega o id do job e value o último número impresso.
+        if response.kind != DONE:
+            return
+        sends = []
+        with self.lock:
+            resource = self.resource(response.text or DEFAULT_RESOURCE)
+            resource.last_printed_number = response.value
+            self.finish_job(resource, response.clock, sends)
+        self.flush(sends)
+
+    def on_numbers_failure(self, message):
+        self.logger.error(f"Failed to notify numbers service: {message}")
+        if message.kind != START:
+            return
+        sends = []
+        with self.lock:
+            # sem print server o nó não deve ficar esperando um DONE que não vem
+            self.finish_job(self.resource(message.text), message.value, sends)
+        self.flush(sends)
+
+    def finish_job(self, resource, job, sends):
+        grant = resource.exclusive_holder()
+        if grant is None or grant.job != job or not grant.printing:
+            self.logger.warning(f"Ignoring DONE of stale job {job} on {resource.name}")
+            return
+        grant.printing = False
+        self.arm_exit_timer(resource, grant)
+        sends.append((grant.channel, Message(DONE, clock=job, value=resource.last_printed_number,
+                                             payload=resource.name.encode())))
+
+    def arm_exit_timer(self, resource, grant):
+        if grant.timer:
+            grant.timer.cancel()
+        grant.timer = self.runtime.call_later(self.EXIT_TIMEOUT, self.on_exit_timeout, resource, grant)
+
+    def handle_client(self, conn, data):
+        self.leases.heard(conn)
+        try:
+            if data.kind == STATS:
+                conn.send(Message(STATS_REPLY, payload=self.metrics.encode()))
+            elif data.kind == ENTER:
+                self.acquire(conn, data)
+            elif data.kind == EXIT:
+                self.release(conn, data.text or DEFAULT_RESOURCE)
+        except Exception as e:
+            self.logger.error(f"ERROR - {e}")
+            self.abort(conn)
+
+    def acquire(self, conn, data):
+        mode = MODE_SHARED if data.value == MODE_SHARED else MODE_EXCLUSIVE
+        grant = Grant(data.sender, data.clock, mode, conn)
+        sends = []
+        with self.lock:
+            resource = self.resource(data.text or DEFAULT_RESOURCE)
+            current = resource.holders.get(conn)
+            if current is not None:
+                # pedido repetido de quem já tem o recurso (ex.: após um timeout no nó)
+                job = current.job if current.printing else 0
+                sends.append((conn, Message(ENTER_OK, clock=self.lease_ms(), value=job,
+                                            payload=resource.name.encode())))
+            elif any(w.channel is conn for w in resource.waiters):
+                pass
+            elif not resource.waiters and resource.compatible(grant):
+                self.grant(resource, grant, sends)
+            else:
+                self.metrics.incr('conflicts')
+                self.logger.warning(f"CS conflict: Node {grant.node_id} waiting for {resource.name}, "
+                                    f"held by {resource.holder_ids()}")
+                resource.waiters.append(grant)
+        self.flush(sends)
+
+    def grant(self, resource, grant, sends):
+        resource.holders[grant.channel] = grant
+        grant.granted = time.monotonic()
+        self.metrics.incr('grants')
+        self.metrics.incr(f'grants.{resource.name}')
+        self.metrics.observe('grant_wait', grant.granted - grant.requested)
+        mode = 'shared' if grant.mode == MODE_SHARED else 'exclusive'
+        self.logger.info(f"ENTER - Node {grant.node_id} on {resource.name} ({mode})")
+        if grant.mode == MODE_EXCLUSIVE:
+            # só o dono exclusivo imprime; o ENTER_OK informa o job a aguardar
+            grant.job = next(self.jobs)
+            grant.printing = True
+            sends.append((self.numbers_service, Message(START, grant.node_id, grant.clock, grant.job,
+                                                        resource.name.encode())))
+        self.arm_exit_timer(resource, grant)
+        self.leases.watch(grant.channel)
+        self.leases.heard(grant.channel)
+        sends.append((grant.channel, Message(ENTER_OK, clock=self.lease_ms(), value=grant.job,
+                                             payload=resource.name.encode())))
+
+    def lease_ms(self):
+        return int(self.LEASE_TIME * 1000)
+
+    def grant_waiters(self, resource, sends):
+        while resource.waiters and resource.compatible(resource.waiters[0]):
+            self.grant(resource, resource.waiters.popleft(), sends)
+
+    def release(self, conn, name):
+        sends = []
+        with self.lock:
+            resource = self.resources.get(name)
+            grant = resource.holders.get(conn) if resource else None
+            if grant is None:
+                self.logger.warning(f"EXIT from {conn.addr} without holding {name}")
+                return
+            self.logger.info(f"EXIT - Node {grant.node_id} from {resource.name}")
+            self.last_timestamp += 10
+            sends.append((conn, Message(EXIT_OK, payload=resource.name.encode())))
+            self.revoke(resource, grant, sends)
+        self.flush(sends)
+
+    def on_exit_timeout(self, resource, grant):
+        sends = []
+        with self.lock:
+            if resource.holders.get(grant.channel) is not grant:
+                return
+            self.logger.error(f"Timeout waiting for EXIT from Node {grant.node_id} on {resource.name}")
+            self.metrics.incr('exit_timeouts')
+            self.revoke(resource, grant, sends)
+        self.flush(sends)
+
+    def on_lease_expired(self, conn):
+        with self.lock:
+            held = [(r.name, r.holders[conn].node_id) for r in self.resources.values() if conn in r.holders]
+        if not held:
+            return
+        for name, node_id in held:
+            self.metrics.incr('lease_expirations')
+            self.logger.error(f"Lease of Node {node_id} on {name} expired after {self.LEASE_TIME}s without renewal")
+        self.abort(conn)
+        # se o dono só estava lento, fica sabendo que perdeu a concessão
+        for name, _ in held:
+            conn.send(Message(ENTER_DENIED, payload=name.encode()))
+
+    def handle_disconnect(self, conn):
+        self.abort(conn)
+
+    def abort(self, conn):
+        sends = []
+        with self.lock:
+            for resource in self.resources.values():
+                if any(w.channel is conn for w in resource.waiters):
+                    resource.waiters = deque(w for w in resource.waiters if w.channel is not conn)
+                grant = resource.holders.get(conn)
+                if grant is not None:
+                    self.logger.warning(f"Revoking {resource.name} from Node {grant.node_id}")
+                    self.revoke(resource, grant, sends)
+                else:
+                    self.grant_waiters(resource, sends)
+        self.flush(sends)
+
+    def revoke(self, resource, grant, sends):
+        del resource.holders[grant.channel]
+        if not any(grant.channel in r.holders for r in self.resources.values()):
+            self.leases.unwatch(grant.channel)
+        self.metrics.observe('hold_time', time.monotonic() - grant.granted)
+        if grant.timer:
+            grant.timer.cancel()
+        if grant.printing:
+            # saiu antes do DONE: interrompe a impressão para liberar a impressora
+            sends.append((self.numbers_service, Message(STOP, value=grant.job, payload=resource.name.encode())))
+        self.grant_waiters(resource, sends)
+
+    def serve(self):
+        self.runtime.listen(self.membership.coordinator[1], self.handle_client, self.handle_disconnect)
+        if self.LEASE_TIME > 0:
+            self.leases.start()
+        self.logger.info("Orquestrador server started")
 
     def start(self):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind(('0.0.0.0', 5000))
-            s.listen()
-            self.logger.info("Orquestrador server started")
-            while True:
-                conn, addr = s.accept()
-                threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
+        self.serve()
+        self.runtime.run_forever()
 
 if __name__ == "__main__":
-    server = Orquestrador()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', help='arquivo JSON com a composição do cluster (padrão: variáveis de ambiente)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='thread')
+    parser.add_argument('--lease', type=float, default=Orquestrador.LEASE_TIME,
+                        help='duração do lease das concessões em segundos (0 desliga)')
+    args = parser.parse_args()
+    Orquestrador.LEASE_TIME = args.lease
+    server = Orquestrador(make_runtime(args.engine, setup_logging()), load_membership(args.config))
     server.start()
@@ -1,125 +1,182 @@
-import socket
+import argparse
 import threading
 import time
-import logging
-import os
 import random
+from collections import deque
+from codec import Message, START, DONE, STOP, STOPPED, DEFAULT_RESOURCE, STATS, STATS_REPLY
+import logutil
+from membership import load_membership
+from metrics import Metrics
+from runtime import ENGINES, ThreadRuntime, make_runtime
 
 def setup_logging():
-    if not os.path.exists('logs'):
-        os.makedirs('logs', exist_ok=True) 
-
-    logger = logging.getLogger('PrintService') 
-    logger.setLevel(logging.INFO)
-
-    if not logger.handlers:
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-        file_handler = logging.FileHandler('logs/print_service.log')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-
-    return logger
+    return logutil.setup_logging('PrintService', 'print_service.log')
+
+class PrintJob:
+    def __init__(self, job_id, printer, node_id, start_value, conn):
+        self.job_id = job_id
+        self.printer = printer
+        self.node_id = node_id
+        self.start_value = start_value
+        self.sequence = list(range(start_value + 1, start_value + 1 + random.randint(1, 10)))
+        self.position = 0
+        self.conn = conn
+        self.timer = None
+        self.submitted = time.monotonic()
+        self.started = None
+
+class Printer:
+    # Uma impressora (recurso) com sua fila de jobs; imprime um job por vez, na
+    # ordem de chegada. O canal de resposta fica em cada job, não na impressora.
+
+    def __init__(self, name):
+        self.name = name
+        self.queue = deque()
+        self.current = None
 
 class NumberPrinter:
-    def __init__(self):
+    # Os jobs esperam na fila da sua impressora e disputam `workers` slots de
+    # impressão; cada slot é um timer no runtime, não um thread. Com intervalo 0
+    # a sequência inteira é impressa de uma vez (modo benchmark).
+    PRINT_INTERVAL = 0.5
+
+    def __init__(self, runtime=None, membership=None, printers=1, workers=None, print_interval=None):
         self.logger = setup_logging()
-        self.active = False
-        self.current_node = None
-        self.current_node_time = 0
-        self.sequence = []
-        self.thread = None
+        self.runtime = runtime or ThreadRuntime(self.logger)
+        self.membership = membership or load_membership()
+        self.printers = {f'printer{i}': Printer(f'printer{i}') for i in range(printers)}
+        # cada impressora imprime um job por vez: slots além de uma por impressora ficam ociosos
+        self.workers = min(workers or printers, printers)
+        if workers and workers > printers:
+            self.logger.warning(f"--workers {workers} exceeds the {printers} printer(s); using {printers}")
+        self.print_interval = self.PRINT_INTERVAL if print_interval is None else print_interval
+        self.busy = 0
+        self.ready = deque()
         self.lock = threading.Lock()
+        self.metrics = Metrics('print_server')
+        self.metrics.gauge('queue_depth', lambda: sum(len(p.queue) for p in self.printers.values()))
+        self.metrics.gauge('busy_workers', lambda: self.busy)
 
-    def start_sequence(self, node_id, start_value, node_timestamp):
+    def submit(self, printer, job_id, node_id, start_value, conn):
         with self.lock:
-            if self.active:
-                self.logger.warning("Number printer already active.")
-                return f"STARTED:{start_value}"
-
-            self.active = True
-            self.current_node = node_id
-            self.current_node_time = node_timestamp
-
-            k = random.randint(1, 10)
-            self.sequence = list(range(start_value + 1, start_value + 1 + k))
-
-            self.thread = threading.Thread(target=self.print_server)
-            self.thread.start()
-
-            return f"STARTED:{self.sequence[-1]}"
-
-    def print_server(self):
-        self.logger.info(f"Node {self.current_node} started printing numbers. | time: {self.current_node_time} | k = {len(self.sequence)}")
-
-        for num in self.sequence:
-            with self.lock:
-                if not self.active:
-                    break
-                self.logger.info(f"Node {self.current_node} >> {num} | {num - self.current_node_time}")
-            time.sleep(0.5)
-
+            job = PrintJob(job_id, printer, node_id, start_value, conn)
+            self.metrics.incr('jobs_submitted')
+            printer.queue.append(job)
+            if len(printer.queue) > 1 or printer.current:
+                self.logger.info(f"[{printer.name}] Queued job {job_id} of Node {node_id} ({len(printer.queue)} waiting)")
+            if printer.current is None and len(printer.queue) == 1:
+                self.ready.append(printer)
+            self.dispatch_jobs()
+
+    def dispatch_jobs(self):
+        while self.busy < self.workers and self.ready:
+            printer = self.ready.popleft()
+            job = printer.queue.popleft()
+            printer.current = job
+            self.busy += 1
+            job.started = time.monotonic()
+            self.metrics.observe('job_wait', job.started - job.submitted)
+            self.logger.info(f"[{printer.name}] Node {job.node_id} started printing numbers. | time: {job.start_value} | k = {len(job.sequence)}")
+            job.timer = self.runtime.call_soon(self.print_server, job)
+
+    def print_server(self, job):
+        # Imprime um número por disparo do timer, sem bloquear um thread com sleep.
         with self.lock:
-            last = self.sequence[-1] if self.sequence else self.current_node_time
-            self.active = False
-            self.logger.info(f"Finished printing for Node {self.current_node}\n\n")
-            try:
-                self.response_conn.sendall(f"DONE:{last}".encode())
-                self.response_conn.close()
-            except Exception as e:
-                self.logger.error(f"Failed to send DONE message: {e}")
-            finally:
-                self.sequence = []
-                self.current_node = None
-
-
-    def stop(self):
+            printer = job.printer
+            if printer.current is not job:
+                return
+            while job.position < len(job.sequence):
+                num = job.sequence[job.position]
+                job.position += 1
+                self.logger.info(f"[{printer.name}] Node {job.node_id} >> {num} | {num - job.start_value}")
+                if self.print_interval > 0:
+                    job.timer = self.runtime.call_later(self.print_interval, self.print_server, job)
+                    return
+
+            last = job.sequence[-1] if job.sequence else job.start_value
+            self.logger.info(f"[{printer.name}] Finished printing for Node {job.node_id}\n\n")
+            self.metrics.incr('jobs_done')
+            self.metrics.incr('numbers_printed', len(job.sequence))
+            self.finish(job)
+        if not job.conn.send(Message(DONE, clock=job.job_id, value=last, payload=printer.name.encode())):
+            self.logger.error(f"[{printer.name}] Failed to send DONE message")
+
+    def finish(self, job):
+        printer = job.printer
+        self.metrics.observe('job_duration', time.monotonic() - job.started)
+        printer.current = None
+        job.timer = None
+        self.busy -= 1
+        if printer.queue:
+            self.ready.append(printer)
+        self.dispatch_jobs()
+
+    def stop(self, printer, job_id):
+        # STOP traz o job em value; 0 interrompe o job em andamento, qualquer que seja.
         with self.lock:
-            self.logger.info(f"Stopped printing for Node {self.current_node}\n")
-            self.active = False
-            self.current_node = None
-
-    def handle_client(self, conn):
+            job = printer.current
+            if job is not None and job_id in (0, job.job_id):
+                self.logger.info(f"[{printer.name}] Stopped printing for Node {job.node_id}\n")
+                self.metrics.incr('jobs_stopped')
+                if job.timer:
+                    job.timer.cancel()
+                self.finish(job)
+                return
+            for queued in printer.queue:
+                if queued.job_id == job_id:
+                    printer.queue.remove(queued)
+                    self.metrics.incr('jobs_dropped')
+                    self.logger.info(f"[{printer.name}] Dropped queued job {job_id} of Node {queued.node_id}")
+                    if not printer.queue and printer in self.ready:
+                        self.ready.remove(printer)
+                    return
+
+    def handle_client(self, conn, data):
         try:
-            data = conn.recv(1024).decode().strip()
-
-            if data.startswith("START:"):
-                parts = data.split(":")
-                if len(parts) == 4:
-                    _, node_id, _, node_timestamp = parts
-                    start_value = int(node_timestamp)
-                else:
-                    _, node_id, _ = parts
-                    start_value = int(time.time())
-
-                self.response_conn = conn
-                self.start_sequence(node_id, start_value, start_value)
+            if data.kind == STATS:
+                conn.send(Message(STATS_REPLY, payload=self.metrics.encode()))
+                return
+            name = data.text or DEFAULT_RESOURCE
+            printer = self.printers.get(name)
+            if printer is None:
+                # responde mesmo assim para o orquestrador não ficar esperando
+                self.logger.error(f"Unknown printer '{name}' requested by Node {data.sender}")
+                if data.kind == START:
+                    conn.send(Message(DONE, clock=data.value, value=data.clock, payload=data.payload))
+                elif data.kind == STOP:
+                    conn.send(Message(STOPPED, payload=data.payload))
                 return
 
-            elif data == "STOP":
-                self.stop()
-                conn.sendall(b"STOPPED")
-                conn.close()
+            # START traz o id do job em value; o DONE devolve esse id no campo clock.
+            if data.kind == START:
+                self.submit(printer, data.value, data.sender, data.clock, conn)
+
+            elif data.kind == STOP:
+                self.stop(printer, data.value)
+                conn.send(Message(STOPPED, value=data.value, payload=data.payload))
 
         except Exception as e:
             self.logger.error(f"Error: {e}")
 
 
-    def start(self):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind(('0.0.0.0', 5001))
-            s.listen()
-            self.logger.info("Print Server service started\n")
+    def serve(self):
+        self.runtime.listen(self.membership.print_server[1], self.handle_client)
+        self.logger.info(f"Print Server service started with {len(self.printers)} printer(s), "
+                         f"{self.workers} worker(s), interval {self.print_interval}s\n")
 
-            while True:
-                conn, _ = s.accept()
-                threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+    def start(self):
+        self.serve()
+        self.runtime.run_forever()
 
 if __name__ == "__main__":
-    server = NumberPrinter()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', help='arquivo JSON com a composição do cluster (padrão: variáveis de ambiente)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='thread')
+    parser.add_argument('--printers', type=int, default=1, help='número de impressoras independentes (printer0..printerN-1)')
+    parser.add_argument('--workers', type=int, help='jobs impressos ao mesmo tempo, no máximo um por impressora (padrão: um por impressora)')
+    parser.add_argument('--print-interval', type=float, default=NumberPrinter.PRINT_INTERVAL,
+                        help='segundos entre números; 0 imprime a sequência de uma vez (benchmark)')
+    args = parser.parse_args()
+    server = NumberPrinter(make_runtime(args.engine, setup_logging()), load_membership(args.config),
+                           args.printers, args.workers, args.print_interval)
     server.start()
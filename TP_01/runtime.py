@@ -0,0 +1,494 @@
+import asyncio
+import heapq
+import itertools
+import select
+import socket
+import threading
+import time
+from collections import deque
+from queue import Queue
+from codec import FRAME_HEADER, FrameDecoder, ProtocolError, decode_frame, encode_frame, read_frame_size
+
+
+# Os serviços são orientados a eventos: recebem mensagens por callbacks
+# on_message(channel, message) com codec.Message, enviam por channel.send(message) e agendam
+# timers com call_later. O runtime decide se isso roda em threads ou em um
+# único event loop asyncio.
+
+CONNECT_TIMEOUT = 2
+# marcador na fila de um link: conecta sem enviar nada (link.open())
+OPEN = object()
+# clusters grandes abrem N-1 conexões por nó quase ao mesmo tempo
+LISTEN_BACKLOG = 1024
+# conexões sendo abertas ao mesmo tempo no engine asyncio; o timeout só conta
+# depois de conseguir a vaga, então uma rajada de conexões não vira falha
+MAX_PENDING_CONNECTS = 64
+
+
+class _Timer:
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _SocketChannel:
+    def __init__(self, sock, addr, logger):
+        self.sock = sock
+        self.addr = addr
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        return self.send_many([message])
+
+    def send_many(self, messages):
+        with self.lock:
+            if self.closed:
+                return False
+            try:
+                self.sock.sendall(encode_frame(messages))
+                return True
+            except OSError as e:
+                self.logger.warning(f"Failed to send to {self.addr}: {e}")
+                return False
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                try:
+                    self.sock.close()
+                except OSError:
+                    pass
+
+
+class ThreadLink:
+    # Conexão de saída persistente; um writer thread esvazia a fila, junta o que
+    # estiver pendente em um único sendall e reconecta quando o link cai. O
+    # thread só é criado no primeiro envio, então links nunca usados não custam nada.
+
+    def __init__(self, runtime, host, port, on_message, on_failure):
+        self.runtime = runtime
+        self.logger = runtime.logger
+        self.host = host
+        self.port = port
+        self.addr = (host, port)
+        self.on_message = on_message
+        self.on_failure = on_failure
+        self.outbox = Queue()
+        self.closed = False
+        self.sock = None
+        self.sock_lock = threading.Lock()
+        self.writer = None
+
+    def _ensure_writer(self):
+        if self.writer is None:
+            with self.sock_lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._writer, daemon=True)
+                    self.writer.start()
+
+    def send(self, message):
+        self.outbox.put(message)
+        self._ensure_writer()
+
+    def send_many(self, messages):
+        for message in messages:
+            self.outbox.put(message)
+        self._ensure_writer()
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def open(self):
+        self.outbox.put(OPEN)
+        self._ensure_writer()
+
+    def close(self):
+        self.closed = True
+        if self.writer is not None:
+            self.outbox.put(None)
+
+    def _writer(self):
+        while True:
+            message = self.outbox.get()
+            if message is None:
+                break
+            batch = [message]
+            while not self.outbox.empty():
+                pending = self.outbox.get_nowait()
+                if pending is None:
+                    self.outbox.put(None)
+                    break
+                batch.append(pending)
+            batch = [m for m in batch if m is not OPEN]
+            if not self._deliver(encode_frame(batch) if batch else b'') and self.on_failure:
+                for m in batch:
+                    self.runtime.dispatch(self.on_failure, m)
+        self._disconnect(self.sock)
+
+    def _deliver(self, data):
+        # Uma nova tentativa cobre o caso de uma conexão antiga que o peer já fechou.
+        for _ in range(2):
+            sock = self.sock
+            try:
+                if sock is None or self._is_stale(sock):
+                    self._disconnect(sock)
+                    sock = self._connect()
+                sock.sendall(data)
+                return True
+            except OSError:
+                self._disconnect(sock)
+        return False
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        with self.sock_lock:
+            self.sock = sock
+        self.logger.info(f"Connected to {self.host}:{self.port}")
+        if self.on_message:
+            threading.Thread(target=self._reader, args=(sock,), daemon=True).start()
+        return sock
+
+    def _reader(self, sock):
+        # Respostas recebidas neste link são entregues com o próprio link como canal.
+        self.runtime.read_loop(sock, self, self.on_message)
+        self._disconnect(sock)
+
+    def _is_stale(self, sock):
+        # Com reader ativo o próprio reader detecta o EOF e derruba o socket.
+        if self.on_message:
+            return False
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+    def _disconnect(self, sock):
+        if sock is None:
+            return
+        with self.sock_lock:
+            if self.sock is sock:
+                self.sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+
+class ThreadRuntime:
+    def __init__(self, logger):
+        self.logger = logger
+        self.running = True
+        self.stopped = threading.Event()
+        self.timers = []
+        self.timer_seq = itertools.count()
+        self.timer_cond = threading.Condition()
+        threading.Thread(target=self._timer_loop, daemon=True).start()
+
+    def listen(self, port, on_message, on_close=None):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('0.0.0.0', port))
+        server.settimeout(1)
+        server.listen(LISTEN_BACKLOG)
+        threading.Thread(target=self._accept_loop, args=(server, on_message, on_close), daemon=True).start()
+
+    def _accept_loop(self, server, on_message, on_close):
+        with server:
+            while self.running:
+                try:
+                    conn, addr = server.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                channel = _SocketChannel(conn, addr, self.logger)
+                threading.Thread(target=self._serve_connection, args=(conn, channel, on_message, on_close), daemon=True).start()
+
+    def _serve_connection(self, conn, channel, on_message, on_close):
+        self.read_loop(conn, channel, on_message)
+        channel.close()
+        if on_close:
+            self.dispatch(on_close, channel)
+
+    def read_loop(self, sock, channel, on_message):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                for message in decoder.feed(data):
+                    self.dispatch(on_message, channel, message)
+        except ProtocolError as e:
+            self.logger.error(f"Protocol error from {channel.addr}: {e}")
+        except OSError as e:
+            if not channel.closed:
+                self.logger.error(f"Connection error: {e}")
+
+    def connect(self, host, port, on_message=None, on_failure=None):
+        return ThreadLink(self, host, port, on_message, on_failure)
+
+    def dispatch(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            self.logger.error(f"Handler error: {e}")
+
+    def call_later(self, delay, callback, *args):
+        timer = _Timer(time.monotonic() + delay, callback, args)
+        with self.timer_cond:
+            heapq.heappush(self.timers, (timer.when, next(self.timer_seq), timer))
+            self.timer_cond.notify()
+        return timer
+
+    def call_soon(self, callback, *args):
+        return self.call_later(0, callback, *args)
+
+    def _timer_loop(self):
+        # Um único thread atende todos os timers, em vez de um thread por espera.
+        while True:
+            with self.timer_cond:
+                while not self.timers or self.timers[0][0] > time.monotonic():
+                    timeout = self.timers[0][0] - time.monotonic() if self.timers else None
+                    self.timer_cond.wait(timeout)
+                _, _, timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                self.dispatch(timer.callback, *timer.args)
+
+    def run_forever(self):
+        try:
+            while not self.stopped.wait(0.1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        self.running = False
+
+    def stop(self):
+        self.running = False
+        self.stopped.set()
+
+
+class _StreamChannel:
+    def __init__(self, writer, logger):
+        self.writer = writer
+        self.logger = logger
+        self.addr = writer.get_extra_info('peername')
+        self.closed = False
+
+    def send(self, message):
+        return self.send_many([message])
+
+    def send_many(self, messages):
+        if self.closed or self.writer.is_closing():
+            return False
+        self.writer.write(encode_frame(messages))
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+
+class AsyncioLink:
+    # Mesma semântica do ThreadLink, mas como tasks no event loop.
+
+    def __init__(self, runtime, host, port, on_message, on_failure):
+        self.runtime = runtime
+        self.logger = runtime.logger
+        self.host = host
+        self.port = port
+        self.addr = (host, port)
+        self.on_message = on_message
+        self.on_failure = on_failure
+        self.outbox = deque()
+        self.wakeup = None
+        self.writer = None
+        self.closed = False
+        runtime.loop.call_soon(self._start)
+
+    def _start(self):
+        self.wakeup = asyncio.Event()
+        self.runtime.loop.create_task(self._write_loop())
+
+    def send(self, message):
+        self.outbox.append(message)
+        if self.wakeup:
+            self.wakeup.set()
+
+    def send_many(self, messages):
+        self.outbox.extend(messages)
+        if self.wakeup:
+            self.wakeup.set()
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    def open(self):
+        self.send(OPEN)
+
+    def close(self):
+        self.closed = True
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def _write_loop(self):
+        while not self.closed:
+            if not self.outbox:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            batch = [m for m in self.outbox if m is not OPEN]
+            self.outbox.clear()
+            if not await self._deliver(encode_frame(batch) if batch else b'') and self.on_failure:
+                for m in batch:
+                    self.runtime.dispatch(self.on_failure, m)
+        self._disconnect(self.writer)
+
+    async def _deliver(self, data):
+        for _ in range(2):
+            writer = self.writer
+            try:
+                if writer is None or writer.is_closing():
+                    writer = await self._connect()
+                writer.write(data)
+                await writer.drain()
+                return True
+            except (OSError, asyncio.TimeoutError):
+                self._disconnect(writer)
+        return False
+
+    async def _connect(self):
+        async with self.runtime.connect_slots:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.writer = writer
+        self.logger.info(f"Connected to {self.host}:{self.port}")
+        self.runtime.loop.create_task(self._read_loop(reader, writer))
+        return writer
+
+    async def _read_loop(self, reader, writer):
+        # O reader também serve para perceber que o peer fechou a conexão.
+        await self.runtime.read_loop(reader, self, self.on_message)
+        self._disconnect(writer)
+
+    def _disconnect(self, writer):
+        if writer is None:
+            return
+        if self.writer is writer:
+            self.writer = None
+        writer.close()
+
+
+class AsyncioRuntime:
+    def __init__(self, logger):
+        self.logger = logger
+        self.loop = asyncio.new_event_loop()
+        self.servers = []
+        # criado dentro do loop: até o Python 3.9 o semáforo se prende ao loop corrente ao nascer
+        self._connect_slots = None
+
+    @property
+    def connect_slots(self):
+        if self._connect_slots is None:
+            self._connect_slots = asyncio.Semaphore(MAX_PENDING_CONNECTS)
+        return self._connect_slots
+
+    def listen(self, port, on_message, on_close=None):
+        async def serve_connection(reader, writer):
+            writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            channel = _StreamChannel(writer, self.logger)
+            try:
+                await self.read_loop(reader, channel, on_message)
+            except asyncio.CancelledError:
+                return  # loop encerrando (run_forever)
+            channel.close()
+            if on_close:
+                self.dispatch(on_close, channel)
+
+        server = asyncio.start_server(serve_connection, '0.0.0.0', port, reuse_address=True,
+                                      backlog=LISTEN_BACKLOG)
+        if self.loop.is_running():
+            self.loop.create_task(self._keep_server(server))
+        else:
+            self.servers.append(self.loop.run_until_complete(server))
+
+    async def _keep_server(self, server):
+        self.servers.append(await server)
+
+    async def read_loop(self, reader, channel, on_message):
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                body = await reader.readexactly(read_frame_size(header))
+                if on_message:
+                    for message in decode_frame(body):
+                        self.dispatch(on_message, channel, message)
+        except asyncio.IncompleteReadError:
+            pass
+        except ProtocolError as e:
+            self.logger.error(f"Protocol error from {channel.addr}: {e}")
+        except OSError as e:
+            if not channel.closed:
+                self.logger.error(f"Connection error: {e}")
+
+    def connect(self, host, port, on_message=None, on_failure=None):
+        return AsyncioLink(self, host, port, on_message, on_failure)
+
+    def dispatch(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            self.logger.error(f"Handler error: {e}")
+
+    def call_later(self, delay, callback, *args):
+        return self.loop.call_later(delay, self.dispatch, callback, *args)
+
+    def call_soon(self, callback, *args):
+        return self.loop.call_soon(self.dispatch, callback, *args)
+
+    def run_forever(self):
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for server in self.servers:
+                server.close()
+            # encerra as conexões pendentes para o loop poder ser descartado sem
+            # avisos; uma volta do loop antes garante que toda task já começou
+            self.loop.run_until_complete(asyncio.sleep(0))
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            # gather() sem tasks cria um future fora deste loop
+            if tasks:
+                self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+ENGINES = {
+    'thread': ThreadRuntime,
+    'asyncio': AsyncioRuntime,
+}
+
+
+def make_runtime(engine, logger):
+    return ENGINES[engine](logger)
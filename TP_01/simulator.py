@@ -0,0 +1,244 @@
+import argparse
+import heapq
+import itertools
+import json
+import random
+import time
+from metrics import percentile
+from mutex_core import Send, Timer, RicartAgrawala, Maekawa, SuzukiKasami
+
+# Simulador de eventos discretos para os núcleos de mutex_core: os mesmos
+# algoritmos dos nós reais, sem sockets e em tempo simulado, para avaliar
+# milhares de nós em segundos. A rede simulada tem latência por mensagem
+# (--latency ± --jitter), é FIFO por par de nós como as conexões TCP, e
+# --loss é a chance de um pacote se perder e ser retransmitido após --rto
+# (o TCP não perde a mensagem, só atrasa ela e as seguintes do mesmo link).
+# --crash derruba nós em --crash-at: mensagens em trânsito para eles somem e
+# envios posteriores falham após --connect-timeout, como no runtime real.
+# Com --detection os demais nós suspeitam do nó derrubado após esse atraso
+# (peer_down no núcleo), como faz o detector de falhas por heartbeat.
+# A seção crítica dura --cs-time; o orquestrador e o print server não são simulados.
+#   closed   cada nó pede de novo após uma pausa exponencial de média --think
+#   poisson  pedidos chegam a --rate/s no cluster, cada um para um nó ao acaso
+
+DELIVER, FAIL, TIMER, EXIT, REQUEST, CRASH, DOWN = range(7)
+LINK_TABLE_LIMIT = 1 << 20
+
+
+def make_core(args, node_id, node_ids):
+    if args.algorithm == 'maekawa':
+        return Maekawa(node_id, node_ids, retry_timeout=args.retry_timeout)
+    if args.algorithm == 'token':
+        return SuzukiKasami(node_id, node_ids, args.token_timeout, args.probe_timeout)
+    return RicartAgrawala(node_id, node_ids, not args.no_permission_reuse)
+
+
+class Simulator:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.node_ids = list(range(1, args.nodes + 1))
+        self.cores = {node_id: make_core(args, node_id, self.node_ids) for node_id in self.node_ids}
+        self.events = []
+        self.seq = itertools.count()
+        self.now = 0.0
+        self.processed = 0
+        self.link_free = {}
+        self.link_limit = LINK_TABLE_LIMIT
+        self.crashed = set()
+        self.holders = set()
+        self.requested = {}
+        self.latencies = []
+        self.entries = 0
+        self.messages = 0
+        self.retransmits = 0
+        self.failed_sends = 0
+        self.missed = 0
+        self.violations = 0
+
+    def schedule(self, at, kind, a, b=None, c=None):
+        heapq.heappush(self.events, (at, next(self.seq), kind, a, b, c))
+
+    def apply(self, node_id, effects):
+        for effect in effects:
+            if type(effect) is Send:
+                self.send(node_id, effect.dest, effect.message)
+            elif type(effect) is Timer:
+                self.schedule(self.now + effect.delay, TIMER, node_id, effect.name, effect.key)
+            else:
+                self.enter(node_id)
+
+    def send(self, src, dest, message):
+        self.messages += 1
+        if dest == src:
+            self.schedule(self.now, DELIVER, dest, message)
+            return
+        if dest in self.crashed:
+            self.failed_sends += 1
+            self.schedule(self.now + self.args.connect_timeout, FAIL, src, dest, message)
+            return
+        args = self.args
+        delay = args.latency * (1 + args.jitter * (2 * self.random.random() - 1))
+        while args.loss and self.random.random() < args.loss:
+            self.retransmits += 1
+            delay += args.rto
+        link = (src, dest)
+        at = max(self.now + delay, self.link_free.get(link, 0.0))
+        self.link_free[link] = at
+        self.schedule(at, DELIVER, dest, message)
+        if len(self.link_free) > self.link_limit:
+            # links sem mensagem em trânsito não restringem mais a ordem de entrega
+            self.link_free = {link: free for link, free in self.link_free.items() if free > self.now}
+            self.link_limit = max(LINK_TABLE_LIMIT, 2 * len(self.link_free))
+
+    def enter(self, node_id):
+        if self.holders:
+            self.violations += 1
+        self.holders.add(node_id)
+        requested = self.requested.pop(node_id, None)
+        if requested is not None:
+            self.latencies.append(self.now - requested)
+        self.schedule(self.now + self.args.cs_time, EXIT, node_id)
+
+    def request(self, node_id):
+        core = self.cores[node_id]
+        if core.requesting or core.in_cs:
+            self.missed += 1
+            return
+        self.requested[node_id] = self.now
+        self.apply(node_id, core.request())
+
+    def exit(self, node_id):
+        self.holders.discard(node_id)
+        self.entries += 1
+        self.apply(node_id, self.cores[node_id].release())
+        if self.args.workload == 'closed':
+            self.schedule(self.now + self.think(), REQUEST, node_id)
+
+    def think(self):
+        return self.random.expovariate(1 / self.args.think) if self.args.think > 0 else 0.0
+
+    def crash(self, node_id):
+        self.crashed.add(node_id)
+        self.holders.discard(node_id)
+        self.requested.pop(node_id, None)
+        if self.args.detection is not None:
+            for other in self.node_ids:
+                if other not in self.crashed:
+                    delay = self.args.detection * (1 + self.args.jitter * self.random.random())
+                    self.schedule(self.now + delay, DOWN, other, node_id)
+
+    def start(self):
+        args = self.args
+        if args.workload == 'closed':
+            for node_id in self.node_ids:
+                self.schedule(self.think(), REQUEST, node_id)
+        else:
+            at = 0.0
+            while True:
+                at += self.random.expovariate(args.rate)
+                if at >= args.duration:
+                    break
+                self.schedule(at, REQUEST, self.random.choice(self.node_ids))
+        crash_at = args.duration / 2 if args.crash_at is None else args.crash_at
+        for node_id in self.random.sample(self.node_ids, args.crash):
+            self.schedule(crash_at, CRASH, node_id)
+
+    def run(self):
+        self.start()
+        args = self.args
+        started = time.perf_counter()
+        events = self.events
+        while events and events[0][0] < args.duration:
+            self.now, _, kind, a, b, c = heapq.heappop(events)
+            self.processed += 1
+            if a in self.crashed:
+                continue
+            if kind == DELIVER:
+                self.apply(a, self.cores[a].receive(b))
+            elif kind == FAIL:
+                self.apply(a, self.cores[a].peer_failed(b, c))
+            elif kind == TIMER:
+                self.apply(a, self.cores[a].timer(b, c))
+            elif kind == EXIT:
+                self.exit(a)
+            elif kind == REQUEST:
+                self.request(a)
+            elif kind == CRASH:
+                self.crash(a)
+            elif kind == DOWN:
+                self.apply(a, self.cores[a].peer_down(b))
+            if args.requests and self.entries >= args.requests:
+                break
+        elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        waiting = [self.now - requested for requested in self.requested.values()]
+        return {
+            'config': vars(self.args),
+            'simulated_seconds': self.now,
+            'wall_seconds': elapsed,
+            'events': self.processed,
+            'events_per_sec': self.processed / elapsed if elapsed else 0.0,
+            'entries': self.entries,
+            'entries_per_sec': self.entries / self.now if self.now else 0.0,
+            'acquire_latency_ms': {
+                'mean': 1000 * sum(self.latencies) / len(self.latencies) if self.latencies else 0.0,
+                'p50': 1000 * percentile(self.latencies, 50),
+                'p99': 1000 * percentile(self.latencies, 99),
+                'max': 1000 * max(self.latencies, default=0.0),
+            },
+            'messages_per_entry': self.messages / max(1, self.entries),
+            'retransmits': self.retransmits,
+            'failed_sends': self.failed_sends,
+            'missed_requests': self.missed,
+            'crashed': len(self.crashed),
+            # pedidos ainda sem a CS no fim; com espera longa indicam um protocolo travado
+            'pending_requests': len(waiting),
+            'oldest_pending_ms': 1000 * max(waiting, default=0.0),
+            'safety_violations': self.violations,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--algorithm', choices=['maekawa', 'ricart', 'token'], default='maekawa')
+    parser.add_argument('--no-permission-reuse', action='store_true',
+                        help='Ricart-Agrawala sem a otimização de Roucairol-Carvalho')
+    parser.add_argument('--workload', choices=['closed', 'poisson'], default='poisson')
+    parser.add_argument('--rate', type=float, default=50.0, help='poisson: pedidos por segundo no cluster')
+    parser.add_argument('--think', type=float, default=1.0, help='closed: pausa média entre saída e novo pedido (s)')
+    parser.add_argument('--cs-time', type=float, default=0.01, help='tempo na CS (s)')
+    parser.add_argument('--latency', type=float, default=0.001, help='latência média de uma mensagem (s)')
+    parser.add_argument('--jitter', type=float, default=0.5, help='variação da latência, fração da média')
+    parser.add_argument('--loss', type=float, default=0.0, help='probabilidade de retransmissão por pacote')
+    parser.add_argument('--rto', type=float, default=0.2, help='atraso de cada retransmissão (s)')
+    parser.add_argument('--crash', type=int, default=0, help='quantidade de nós derrubados')
+    parser.add_argument('--crash-at', type=float, help='instante das quedas (padrão: metade da duração)')
+    parser.add_argument('--connect-timeout', type=float, default=2.0)
+    parser.add_argument('--detection', type=float,
+                        help='atraso até os demais suspeitarem de um nó derrubado (padrão: sem detector)')
+    parser.add_argument('--retry-timeout', type=float, default=5.0,
+                        help='maekawa: reenvia o pedido aos árbitros que não votaram após este tempo (s)')
+    parser.add_argument('--token-timeout', type=float, default=15.0)
+    parser.add_argument('--probe-timeout', type=float, default=2.0)
+    parser.add_argument('--duration', type=float, default=60.0, help='tempo simulado (s)')
+    parser.add_argument('--requests', type=int, default=0, help='para após este número de entradas (0: sem limite)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='simulation.json')
+    args = parser.parse_args()
+    if not 0 <= args.loss < 1 or args.crash > args.nodes or args.rate <= 0:
+        parser.error('--loss must be in [0, 1), --crash at most --nodes and --rate positive')
+
+    result = Simulator(args).run()
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    latency = result['acquire_latency_ms']
+    print(f"{args.algorithm}/{args.workload} N={args.nodes}: {result['entries']} entries in "
+          f"{result['simulated_seconds']:.1f}s simulated ({result['wall_seconds']:.1f}s wall, "
+          f"{result['events_per_sec']:.0f} events/s), acquire p50={latency['p50']:.2f}ms "
+          f"p99={latency['p99']:.2f}ms, {result['messages_per_entry']:.1f} msgs/entry, "
+          f"{result['pending_requests']} pending, {result['safety_violations']} safety violations "
+          f"-> {args.output}")
@@ -0,0 +1,82 @@
+import argparse
+import json
+import socket
+import time
+from codec import Message, STATS, STATS_REPLY, FrameDecoder, encode_frame
+from membership import load_membership, parse_address
+
+# Consulta as métricas de um ou mais serviços pela porta de cada um:
+#   python3 stats.py orquestrador:5000 node1:5001
+#   python3 stats.py --all --config cluster.json --watch 2
+
+
+def query(address, timeout=2):
+    with socket.create_connection(address, timeout=timeout) as sock:
+        sock.sendall(encode_frame([Message(STATS)]))
+        decoder = FrameDecoder()
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                raise ConnectionError(f"{address[0]}:{address[1]} closed the connection")
+            for message in decoder.feed(data):
+                if message.kind == STATS_REPLY:
+                    return json.loads(message.payload)
+
+
+def format_snapshot(snapshot, previous=None):
+    lines = [f"== {snapshot['service']} (up {snapshot['uptime']:.0f}s)"]
+    elapsed = snapshot['uptime'] - previous['uptime'] if previous else None
+    for name, value in sorted(snapshot['counters'].items()):
+        line = f"  {name:<28} {value:>10}"
+        if elapsed:
+            rate = (value - previous['counters'].get(name, 0)) / elapsed
+            line += f"  {rate:>9.1f}/s"
+        lines.append(line)
+    for name, value in sorted(snapshot['gauges'].items()):
+        lines.append(f"  {name:<28} {value:>10}")
+    for name, h in sorted(snapshot['histograms'].items()):
+        lines.append(f"  {name:<28} n={h['count']} mean={h['mean'] * 1000:.2f}ms "
+                     f"p50={h['p50'] * 1000:.2f}ms p90={h['p90'] * 1000:.2f}ms "
+                     f"p99={h['p99'] * 1000:.2f}ms max={h['max'] * 1000:.2f}ms")
+    return '\n'.join(lines)
+
+
+def targets_from_args(args):
+    targets = [parse_address(value) for value in args.targets]
+    if args.all:
+        membership = load_membership(args.config)
+        targets.append(membership.coordinator)
+        targets.append(membership.print_server)
+        targets.extend(membership.address(node_id) for node_id in membership.ids)
+    return targets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('targets', nargs='*', help='endereços host:porta dos serviços')
+    parser.add_argument('--all', action='store_true', help='consulta todos os serviços do cluster')
+    parser.add_argument('--config', help='arquivo JSON com a composição do cluster (padrão: variáveis de ambiente)')
+    parser.add_argument('--watch', type=float, help='repete a consulta a cada N segundos, mostrando taxas')
+    parser.add_argument('--json', action='store_true', help='imprime o snapshot bruto em JSON')
+    args = parser.parse_args()
+    targets = targets_from_args(args)
+    if not targets:
+        parser.error('informe ao menos um host:porta ou --all')
+
+    previous = {}
+    while True:
+        for address in targets:
+            try:
+                snapshot = query(address)
+            except (OSError, ValueError) as e:
+                print(f"== {address[0]}:{address[1]} unavailable: {e}")
+                continue
+            if args.json:
+                print(json.dumps(snapshot))
+            else:
+                print(format_snapshot(snapshot, previous.get(address)))
+            previous[address] = snapshot
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+        print()
@@ -0,0 +1,50 @@
+import logging
+import socket
+import unittest
+from runtime import ENGINES, make_runtime
+
+# Encerramento dos dois engines: run_forever deve voltar sem exceção com stop()
+# ou Ctrl+C, tanto ocioso quanto com conexões abertas.
+#   python3 -m unittest test_runtime
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def interrupt():
+    raise KeyboardInterrupt
+
+
+class ShutdownTest(unittest.TestCase):
+    def run_until(self, engine, stopper, connect=False):
+        runtime = make_runtime(engine, logging.getLogger('test'))
+        port = free_port()
+        runtime.listen(port, lambda channel, message: None)
+        if connect:
+            runtime.call_soon(lambda: runtime.connect('127.0.0.1', port).open())
+        runtime.call_later(0.2, stopper, runtime)
+        runtime.run_forever()
+
+    def test_stop_idle(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.run_until(engine, lambda runtime: runtime.stop())
+
+    def test_stop_with_connection(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.run_until(engine, lambda runtime: runtime.stop(), connect=True)
+
+    def test_interrupt_idle(self):
+        # no engine thread o Ctrl+C chega no thread principal, fora dos callbacks
+        self.run_until('asyncio', lambda runtime: interrupt())
+
+    def test_interrupt_with_connection(self):
+        self.run_until('asyncio', lambda runtime: interrupt(), connect=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
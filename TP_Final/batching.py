@@ -0,0 +1,89 @@
+import queue
+import threading
+import torch
+
+# --- Iterador de batches em memória ---
+# Substitui TensorDataset + DataLoader para dados que já estão em tensores: em vez
+# de indexar amostra por amostra e empilhar em Python, cada batch sai de uma vez,
+# com index_select sobre uma permutação (shuffle) ou como fatia contígua (sem
+# shuffle, sem cópia). A permutação é sorteada uma vez por época a partir de
+# seed + época, como o DistributedSampler, então set_epoch() deve ser chamado a
+# cada época. Os tensores recebidos já são o shard do rank (ver data_prep.py);
+# o rank entra na semente para que cada rank embaralhe de um jeito.
+# Com prefetch > 0 um thread monta os próximos batches enquanto o passo atual
+# roda: o index_select solta o GIL, então a montagem sobrepõe o forward/backward.
+
+
+class BatchIterator:
+    def __init__(self, X, y, batch_size=64, shuffle=True, seed=42, rank=0, drop_last=False, prefetch=0):
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed + rank
+        self.drop_last = drop_last
+        self.prefetch = prefetch
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.X) // self.batch_size
+        return (len(self.X) + self.batch_size - 1) // self.batch_size
+
+    def batches(self):
+        n = len(self) * self.batch_size if self.drop_last else len(self.X)
+        if not self.shuffle:
+            for start in range(0, n, self.batch_size):
+                yield self.X[start:start + self.batch_size], self.y[start:start + self.batch_size]
+            return
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.X), generator=generator)
+        for start in range(0, n, self.batch_size):
+            idx = order[start:start + self.batch_size]
+            yield self.X.index_select(0, idx), self.y.index_select(0, idx)
+
+    def __iter__(self):
+        if self.prefetch <= 0:
+            return self.batches()
+        return self.prefetched()
+
+    def prefetched(self):
+        ready = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in self.batches():
+                    if not put(batch):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
+
+        worker = threading.Thread(target=produce, daemon=True)
+        worker.start()
+        try:
+            while True:
+                batch = ready.get()
+                if batch is done:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # o laço de treino pode sair antes do fim (break/exceção): libera o thread
+            stop.set()
+            worker.join()
@@ -0,0 +1,83 @@
+import argparse
+import json
+import torch.multiprocessing as mp
+from main import build_parser, run_ddp_training
+from data_prep import prepare_dataset
+
+# --- Benchmark dos modos de comunicação ---
+# Roda o mesmo treinamento (mesmos dados, mesma semente) uma vez por configuração,
+# com --world-size processos nesta máquina, e compara tempo por passo, amostras/s
+# e acurácia de teste com a primeira configuração (a base, fp32 por padrão).
+# Cada configuração é "modo[:chave=valor,...]", com chaves:
+#   bucket=MB  accum=K  rank=R (powersgd)  period=P (localsgd)  warmup=N
+# Ex.: python bench_comm.py --configs fp32 fp16 powersgd:rank=2 localsgd:period=8 fp32:accum=4
+
+CONFIG_KEYS = {
+    'bucket': ('bucket_cap_mb', float),
+    'accum': ('grad_accum', int),
+    'rank': ('powersgd_rank', int),
+    'period': ('local_sgd_period', int),
+    'warmup': ('comm_warmup', int),
+}
+
+
+def config_args(spec, base_args):
+    mode, _, options = spec.partition(':')
+    args = build_parser().parse_args(base_args + ['--comm', mode])
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        if key not in CONFIG_KEYS:
+            raise ValueError(f"Unknown option '{key}' in config '{spec}'")
+        name, kind = CONFIG_KEYS[key]
+        setattr(args, name, kind(value))
+    return args
+
+
+def worker(rank, world_size, port, args, results):
+    result = run_ddp_training(rank, world_size, "localhost", str(port), args)
+    if rank == 0:
+        results.put(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara os modos de comunicação do DDP")
+    parser.add_argument("--configs", nargs="+", default=["fp32", "fp16", "bf16", "powersgd", "localsgd"])
+    parser.add_argument("--world-size", type=int, default=3)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--num-samples", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--cache-dir", default="data_cache")
+    parser.add_argument("--port", type=int, default=29600)
+    parser.add_argument("--output", default="bench_comm.json")
+    bench = parser.parse_args()
+
+    base_args = ['--epochs', str(bench.epochs), '--num-samples', str(bench.num_samples),
+                 '--batch-size', str(bench.batch_size), '--cache-dir', bench.cache_dir,
+                 '--eval-interval', '0', '--log-interval', '0', '--checkpoint-dir', '']
+    runs = [(spec, config_args(spec, base_args)) for spec in bench.configs]
+    prepare_dataset(bench.cache_dir, bench.num_samples)
+
+    context = mp.get_context("spawn")
+    rows = []
+    for index, (spec, args) in enumerate(runs):
+        results = context.SimpleQueue()
+        # uma porta por execução: a anterior pode ainda estar em TIME_WAIT
+        mp.spawn(worker, args=(bench.world_size, bench.port + index, args, results),
+                 nprocs=bench.world_size, join=True)
+        rows.append(dict(results.get(), config=spec))
+
+    baseline = rows[0]
+    for row in rows:
+        # pela vazão: com accum=K um passo cobre K micro-batches
+        row['speedup'] = row['samples_per_sec'] / baseline['samples_per_sec'] if baseline['samples_per_sec'] else 0.0
+        row['accuracy_delta'] = row['accuracy'] - baseline['accuracy']
+
+    with open(bench.output, 'w') as f:
+        json.dump({'world_size': bench.world_size, 'epochs': bench.epochs,
+                   'num_samples': bench.num_samples, 'results': rows}, f, indent=2)
+
+    print(f"{'config':<24}{'ms/passo':>10}{'amostras/s':>12}{'speedup':>9}{'acurácia':>10}{'Δacc':>8}")
+    for row in rows:
+        print(f"{row['config']:<24}{row['step_time_ms']:>10.2f}{row['samples_per_sec']:>12.0f}"
+              f"{row['speedup']:>8.2f}x{row['accuracy']:>10.4f}{row['accuracy_delta']:>+8.4f}")
+    print(f"-> {bench.output}")
@@ -0,0 +1,94 @@
+import argparse
+import itertools
+import json
+from launch import numa_nodes, split_cores, run
+from data_prep import prepare_dataset
+from profiling import PHASES
+
+# --- Benchmark de vazão do treinamento ---
+# Varre world size x batch size x tamanhos das camadas ocultas, rodando o main.py
+# pelo launch.py (núcleos divididos entre os ranks, afinidade e threads por rank).
+# Para cada configuração grava a vazão total e por rank, os percentis do tempo de
+# passo e o tempo médio de cada fase (ver profiling.py) em JSON e em uma tabela
+# Markdown, para achar onde a escala satura antes de mudar o treinamento de verdade.
+# A fase allreduce só é medida com --profile-comm, que deixa o fp32 um pouco mais lento.
+#   python bench_train.py --world-sizes 1 2 4 --batch-sizes 64 512 --hidden 128,64 512,256
+
+
+def summarize(world_size, batch_size, hidden, results):
+    profiles = [result['profile'] for result in results]
+    slowest = max(profiles, key=lambda profile: profile['step_time_ms']['p50'])
+    return {
+        'world_size': world_size,
+        'batch_size': batch_size,
+        'hidden': hidden,
+        'samples_per_sec': sum(profile['samples_per_sec'] for profile in profiles),
+        'rank_samples_per_sec': [profile['samples_per_sec'] for profile in profiles],
+        # o passo anda no ritmo do rank mais lento
+        'step_time_ms': slowest['step_time_ms'],
+        'phases_ms': {phase: slowest['phases_ms'][phase]['mean'] for phase in PHASES},
+        'accuracy': results[0]['accuracy'],
+    }
+
+
+def markdown(rows):
+    header = ['world', 'batch', 'hidden', 'amostras/s', 'por rank', 'p50 ms', 'p99 ms'] + PHASES + ['acurácia']
+    lines = ['| ' + ' | '.join(header) + ' |', '|' + '---|' * len(header)]
+    for row in rows:
+        cells = [row['world_size'], row['batch_size'], row['hidden'], f"{row['samples_per_sec']:.0f}",
+                 f"{min(row['rank_samples_per_sec']):.0f}-{max(row['rank_samples_per_sec']):.0f}",
+                 f"{row['step_time_ms']['p50']:.2f}", f"{row['step_time_ms']['p99']:.2f}"]
+        cells += [f"{row['phases_ms'][phase]:.2f}" for phase in PHASES]
+        cells.append(f"{row['accuracy']:.4f}")
+        lines.append('| ' + ' | '.join(map(str, cells)) + ' |')
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede a vazão do treinamento DDP em várias configurações")
+    parser.add_argument("--world-sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--hidden", nargs="+", default=["128,64", "512,256"],
+                        help="tamanhos das camadas ocultas, no formato H1,H2")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--num-samples", type=int, default=200000)
+    parser.add_argument("--cache-dir", default="data_cache")
+    parser.add_argument("--comm", default="fp32")
+    parser.add_argument("--profile-comm", action="store_true",
+                        help="mede a fase allreduce (no fp32 troca o all-reduce nativo do DDP)")
+    parser.add_argument("--use-hyperthreads", action="store_true")
+    parser.add_argument("--port", type=int, default=29700)
+    parser.add_argument("--output", default="bench_train", help="prefixo dos arquivos .json e .md")
+    args = parser.parse_args()
+
+    nodes = numa_nodes(args.use_hyperthreads)
+    cores = sum(len(cpus) for cpus in nodes)
+    if max(args.world_sizes) > cores:
+        parser.error(f"--world-sizes must not exceed the {cores} available cores")
+    prepare_dataset(args.cache_dir, args.num_samples)
+
+    rows = []
+    configs = list(itertools.product(args.world_sizes, args.batch_sizes, args.hidden))
+    for index, (world_size, batch_size, hidden) in enumerate(configs):
+        hidden1, hidden2 = hidden.split(',')
+        main_args = ['--epochs', str(args.epochs), '--num-samples', str(args.num_samples),
+                     '--cache-dir', args.cache_dir, '--batch-size', str(batch_size),
+                     '--hidden1', hidden1, '--hidden2', hidden2, '--comm', args.comm,
+                     '--checkpoint-dir', '', '--eval-interval', '0', '--log-interval', '0']
+        if args.profile_comm:
+            main_args.append('--profile-comm')
+        print(f"[{index + 1}/{len(configs)}] world={world_size} batch={batch_size} hidden={hidden}")
+        groups = split_cores(nodes, world_size)
+        row = summarize(world_size, batch_size, hidden, run(groups, main_args, args.port + index, 1))
+        rows.append(row)
+        print(f"    {row['samples_per_sec']:.0f} amostras/s, passo p50 {row['step_time_ms']['p50']:.2f} ms")
+
+    with open(f"{args.output}.json", "w") as f:
+        json.dump({'cores': cores, 'numa_nodes': len(nodes), 'epochs': args.epochs,
+                   'num_samples': args.num_samples, 'results': rows}, f, indent=2)
+    table = markdown(rows)
+    with open(f"{args.output}.md", "w") as f:
+        f.write(table)
+    print()
+    print(table)
+    print(f"-> {args.output}.json, {args.output}.md")
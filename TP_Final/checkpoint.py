@@ -0,0 +1,152 @@
+import json
+import os
+import random
+import re
+import shutil
+import threading
+import numpy as np
+import torch
+import torch.distributed as dist
+
+# --- Checkpoints assíncronos por rank ---
+# Cada checkpoint é uma pasta <dir>/epoch_NNNNNN com:
+#   model.pt      modelo, otimizador, próxima época e passos (gravado pelo rank 0)
+#   rank_R.pt     estado dos geradores aleatórios do rank R (cada rank grava o seu)
+#   meta.json     época, world_size e a configuração do modelo e dos dados (dimensões das
+#                 camadas, número de amostras), gravado pelo rank 0 depois de model.pt
+# O estado é copiado no thread de treino (rápido, só memória) e um thread de fundo
+# grava o arquivo; cada arquivo é escrito em um .tmp e publicado com os.replace, então
+# um processo morto no meio da gravação nunca deixa um checkpoint corrompido. Uma
+# pasta só conta como completa quando tem meta.json e os arquivos de todos os ranks.
+# Na inicialização o rank 0 escolhe o checkpoint completo mais recente e todos
+# retomam dele; a ordem dos batches volta junto porque o BatchIterator só depende
+# da época. O rank 0 mantém os `keep` checkpoints completos mais recentes.
+# Um checkpoint gravado com outra configuração não é carregado: a execução para com
+# uma mensagem em vez de falhar no load_state_dict ou treinar com outros dados.
+# Supõe que a pasta é vista por todos os ranks (uma máquina ou sistema de arquivos compartilhado).
+
+CHECKPOINT_PATTERN = re.compile(r'^epoch_(\d{6})$')
+
+
+def snapshot(value):
+    # cópia profunda dos tensores, para o treino seguir alterando os originais
+    if torch.is_tensor(value):
+        return value.detach().clone()
+    if isinstance(value, dict):
+        return {key: snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(snapshot(item) for item in value)
+    return value
+
+
+class Checkpointer:
+    def __init__(self, directory, rank, world_size, keep=3, config=None):
+        self.directory = directory
+        self.rank = rank
+        self.world_size = world_size
+        self.config = config or {}
+        self.keep = max(1, keep)
+        self.writer = None
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, epoch):
+        return os.path.join(self.directory, f'epoch_{epoch:06d}')
+
+    def complete(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return all(os.path.exists(os.path.join(path, f'rank_{r}.pt')) for r in range(meta['world_size']))
+
+    def checkpoints(self):
+        names = [name for name in os.listdir(self.directory) if CHECKPOINT_PATTERN.match(name)]
+        return sorted(names, reverse=True)
+
+    def save(self, epoch, model, optimizer, steps):
+        # `epoch` é a próxima época a rodar. Espera a gravação anterior: no máximo uma
+        # cópia do estado em memória e checkpoints sempre publicados em ordem.
+        self.wait()
+        files = {f'rank_{self.rank}.pt': {
+            'epoch': epoch,
+            'torch_rng': torch.get_rng_state(),
+            'python_rng': random.getstate(),
+            'numpy_rng': np.random.get_state(),
+        }}
+        if self.rank == 0:
+            files['model.pt'] = {
+                'epoch': epoch,
+                'steps': steps,
+                'model': snapshot(model.state_dict()),
+                'optimizer': snapshot(optimizer.state_dict()),
+            }
+        self.writer = threading.Thread(target=self.write, args=(self.path(epoch), files), daemon=True)
+        self.writer.start()
+
+    def write(self, path, files):
+        try:
+            os.makedirs(path, exist_ok=True)
+            for name, state in files.items():
+                target = os.path.join(path, name)
+                torch.save(state, target + '.tmp')
+                os.replace(target + '.tmp', target)
+            if self.rank == 0:
+                meta = os.path.join(path, 'meta.json')
+                with open(meta + '.tmp', 'w') as f:
+                    json.dump({'epoch': files['model.pt']['epoch'], 'world_size': self.world_size,
+                               'config': self.config}, f)
+                os.replace(meta + '.tmp', meta)
+                self.prune()
+        except Exception as e:
+            self.error = e
+
+    def prune(self):
+        kept = 0
+        for name in self.checkpoints():
+            if kept >= self.keep:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            elif self.complete(name):
+                kept += 1
+
+    def wait(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            print(f"Process {self.rank}: Falha ao gravar checkpoint: {error}")
+
+    def resume(self, model, optimizer):
+        # Devolve (época inicial, passos); (0, 0) se não houver checkpoint completo
+        latest = [None]
+        if self.rank == 0:
+            latest[0] = next((name for name in self.checkpoints() if self.complete(name)), None)
+        dist.broadcast_object_list(latest, src=0)
+        if latest[0] is None:
+            return 0, 0
+
+        path = os.path.join(self.directory, latest[0])
+        with open(os.path.join(path, 'meta.json')) as f:
+            saved = json.load(f).get('config', {})
+        different = {key: (saved.get(key), value) for key, value in self.config.items() if saved.get(key) != value}
+        if different:
+            raise SystemExit(f"Checkpoint {path} does not match this run ("
+                             + ", ".join(f"{key}: {old} != {new}" for key, (old, new) in different.items())
+                             + "); use another --checkpoint-dir or remove it")
+        state = torch.load(os.path.join(path, 'model.pt'), map_location='cpu')
+        model.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        # com outro world_size (reinício elástico) um rank novo não tem estado próprio
+        rank_file = os.path.join(path, f'rank_{self.rank}.pt')
+        if os.path.exists(rank_file):
+            rng = torch.load(rank_file, map_location='cpu')
+            torch.set_rng_state(rng['torch_rng'])
+            random.setstate(rng['python_rng'])
+            np.random.set_state(rng['numpy_rng'])
+        return state['epoch'], state['steps']
+
+    def close(self):
+        self.wait()
@@ -0,0 +1,69 @@
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.distributed.algorithms.ddp_comm_hooks import default_hooks, powerSGD_hook
+from torch.distributed.algorithms.model_averaging import averagers, utils as averaging_utils
+
+# --- Modos de comunicação dos gradientes no DDP ---
+#   fp32      all-reduce padrão do DDP (gradientes em float32)
+#   fp16      gradientes comprimidos para float16 antes do all-reduce (metade dos bytes)
+#   bf16      idem com bfloat16: mesma faixa do float32, menos precisão
+#   powersgd  aproximação de posto baixo (--powersgd-rank) com error feedback; até
+#             warmup_steps os gradientes vão sem compressão
+#   localsgd  após warmup_steps cada rank dá passos só com os próprios gradientes e a
+#             média dos parâmetros é feita a cada --local-sgd-period passos
+# bucket_cap_mb controla o tamanho dos buckets do all-reduce: buckets maiores geram
+# menos mensagens (melhor no TCP do gloo), menores começam a sobrepor com o backward antes.
+
+COMM_MODES = ['fp32', 'fp16', 'bf16', 'powersgd', 'localsgd']
+
+
+class LocalSGDState:
+    def __init__(self, warmup_steps):
+        self.warmup_steps = warmup_steps
+        self.step = 0
+
+
+def local_sgd_hook(state, bucket):
+    if state.step < state.warmup_steps:
+        future = default_hooks.allreduce_hook(None, bucket)
+    else:
+        # sem comunicação: o rank aplica o próprio gradiente e o averager sincroniza depois
+        future = torch.futures.Future()
+        future.set_result(bucket.buffer())
+    if bucket.is_last():
+        state.step += 1
+    return future
+
+
+def wrap_model(model, mode='fp32', bucket_cap_mb=25, powersgd_rank=1, local_sgd_period=4, warmup_steps=10,
+               profiler=None):
+    # Devolve o modelo DDP e, no modo localsgd, o averager a chamar depois de cada optimizer.step().
+    # Com um profiler (profiling.StepProfiler, só com --profile-comm) o hook é envolvido para
+    # medir o all-reduce; no modo fp32 o all-reduce nativo vira o allreduce_hook equivalente,
+    # que pode ser medido mas é mais lento. Sem profiler o fp32 fica sem hook.
+    ddp_model = DDP(model, bucket_cap_mb=bucket_cap_mb)
+    averager = None
+    if mode == 'fp32':
+        state, hook = None, default_hooks.allreduce_hook if profiler else None
+    elif mode == 'fp16':
+        state, hook = None, default_hooks.fp16_compress_hook
+    elif mode == 'bf16':
+        state, hook = None, default_hooks.bf16_compress_hook
+    elif mode == 'powersgd':
+        state = powerSGD_hook.PowerSGDState(process_group=None, matrix_approximation_rank=powersgd_rank,
+                                            start_powerSGD_iter=max(2, warmup_steps))
+        hook = powerSGD_hook.powerSGD_hook
+    elif mode == 'localsgd':
+        state, hook = LocalSGDState(warmup_steps), local_sgd_hook
+        averager = averagers.PeriodicModelAverager(period=local_sgd_period, warmup_steps=warmup_steps)
+    else:
+        raise ValueError(f"Unknown communication mode: {mode}")
+    if hook is not None:
+        ddp_model.register_comm_hook(state, profiler.timed_hook(hook) if profiler else hook)
+    return ddp_model, averager
+
+
+def sync_parameters(model):
+    # localsgd: entre duas médias os ranks divergem; iguala os parâmetros antes de avaliar
+    averaging_utils.average_parameters(model.parameters(), dist.group.WORLD)
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import numpy as np
+from sklearn.datasets import make_classification
+
+# --- Preparação dos dados em cache ---
+# O dataset é gerado uma única vez e gravado em disco já padronizado (float32),
+# em arquivos .npy que cada rank abre com memory-map. Cada rank só lê as linhas
+# do seu shard, então o tempo de inicialização e a memória por rank não crescem
+# com num_samples nem com o número de ranks. O cache fica em
+#   <cache_dir>/classification_n<amostras>_f<features>_s<seed>/
+#     X_train.npy y_train.npy X_test.npy y_test.npy  dados padronizados
+#     scaler.npz                                     média e desvio do treino
+#     meta.json                                      gravado por último: cache completo
+
+CHUNK_ROWS = 1 << 18
+TEST_SIZE = 0.2
+
+
+def cache_path(cache_dir, num_samples, n_features=20, seed=42):
+    return os.path.join(cache_dir, f"classification_n{num_samples}_f{n_features}_s{seed}")
+
+
+def load_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def prepare_dataset(cache_dir, num_samples=10000, n_features=20, seed=42):
+    # Devolve o caminho do cache, gerando os arquivos se ainda não existirem.
+    path = cache_path(cache_dir, num_samples, n_features, seed)
+    if load_meta(path) is not None:
+        return path
+
+    # Problema binário de n_features atributos: 10 informativos e 5 redundantes
+    X, y = make_classification(n_samples=num_samples, n_features=n_features,
+                               n_informative=10, n_redundant=5,
+                               n_classes=2, random_state=seed)
+    order = np.random.default_rng(seed).permutation(num_samples)
+    n_test = int(np.ceil(num_samples * TEST_SIZE))
+    test_idx, train_idx = order[:n_test], order[n_test:]
+
+    # Estatísticas do StandardScaler calculadas por blocos, sem copiar o treino inteiro
+    total = np.zeros(n_features)
+    total_sq = np.zeros(n_features)
+    for start in range(0, len(train_idx), CHUNK_ROWS):
+        block = X[train_idx[start:start + CHUNK_ROWS]]
+        total += block.sum(axis=0)
+        total_sq += np.square(block).sum(axis=0)
+    mean = total / len(train_idx)
+    scale = np.sqrt(np.maximum(total_sq / len(train_idx) - np.square(mean), 0.0))
+    scale[scale == 0.0] = 1.0
+
+    # Grava em um diretório temporário e publica com um rename: um cache pela metade nunca é lido
+    tmp = f"{path}.tmp-{socket.gethostname()}-{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    for name, idx in (('train', train_idx), ('test', test_idx)):
+        X_out = np.lib.format.open_memmap(os.path.join(tmp, f'X_{name}.npy'), mode='w+',
+                                          dtype=np.float32, shape=(len(idx), n_features))
+        y_out = np.lib.format.open_memmap(os.path.join(tmp, f'y_{name}.npy'), mode='w+',
+                                          dtype=np.float32, shape=(len(idx), 1))
+        for start in range(0, len(idx), CHUNK_ROWS):
+            rows = idx[start:start + CHUNK_ROWS]
+            X_out[start:start + len(rows)] = (X[rows] - mean) / scale
+            y_out[start:start + len(rows), 0] = y[rows]
+        X_out.flush()
+        y_out.flush()
+        del X_out, y_out
+
+    np.savez(os.path.join(tmp, 'scaler.npz'), mean=mean, scale=scale)
+    meta = {'num_samples': num_samples, 'n_features': n_features, 'seed': seed,
+            'n_train': len(train_idx), 'n_test': n_test, 'dtype': 'float32'}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # outro processo (ex.: outro host com o mesmo sistema de arquivos) publicou antes
+        shutil.rmtree(tmp, ignore_errors=True)
+        if load_meta(path) is None:
+            raise
+    return path
+
+
+def shard_range(n_rows, rank, world_size, equal=True):
+    # Shards contíguos e do mesmo tamanho em todos os ranks: com tamanhos diferentes
+    # os ranks fariam números diferentes de passos e o all-reduce do DDP travaria.
+    # As até world_size-1 linhas que sobram ficam de fora. Com equal=False (avaliação)
+    # as sobras são distribuídas e todas as linhas entram em algum shard.
+    if not equal:
+        return rank * n_rows // world_size, (rank + 1) * n_rows // world_size
+    per_rank = n_rows // world_size
+    return rank * per_rank, (rank + 1) * per_rank
+
+
+def load_split(path, split, rank=0, world_size=1, equal=True):
+    # Memory-map copy-on-write: só as páginas do shard são lidas do disco e o
+    # array é gravável, como o torch.from_numpy espera.
+    X = np.load(os.path.join(path, f'X_{split}.npy'), mmap_mode='c')
+    y = np.load(os.path.join(path, f'y_{split}.npy'), mmap_mode='c')
+    start, end = shard_range(len(X), rank, world_size, equal)
+    return X[start:end], y[start:end]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Gera o cache do dataset antes do treinamento')
+    parser.add_argument('--cache-dir', default='data_cache')
+    parser.add_argument('--num-samples', type=int, default=10000)
+    parser.add_argument('--n-features', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    path = prepare_dataset(args.cache_dir, args.num_samples, args.n_features, args.seed)
+    print(f"Dataset em cache: {path}")
+    print(json.dumps(load_meta(path), indent=2))
@@ -0,0 +1,186 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# --- Lançador ciente da topologia da CPU ---
+# Sobe os ranks do main.py nesta máquina sem que eles disputem os mesmos núcleos:
+# por padrão cada rank do PyTorch usa todos os núcleos, e 3 ranks em 8 núcleos
+# rodam 24 threads que se atrapalham. Aqui os núcleos físicos são divididos em
+# partes iguais entre os ranks, de preferência sem atravessar nós NUMA (ver
+# split_cores), e cada rank recebe afinidade só para os seus núcleos e
+# --threads igual à quantidade deles. Threads irmãs (hyperthreading) ficam de
+# fora, a não ser com --use-hyperthreads.
+# Com --nproc auto cada candidato (1, potências de 2 e o número de nós NUMA, até o
+# número de núcleos) treina --trial-epochs época(s) e o de maior vazão total é usado.
+# Mais ranks também significam um batch global maior (--batch-size é por rank).
+#   python launch.py --nproc auto -- --epochs 10 --num-samples 1000000
+
+SYSFS_NODES = '/sys/devices/system/node/node[0-9]*'
+SYSFS_CPU = '/sys/devices/system/cpu/cpu{}/topology/{}'
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+
+def parse_cpulist(text):
+    cpus = []
+    for part in filter(None, text.strip().split(',')):
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def read_topology(cpu, name):
+    try:
+        with open(SYSFS_CPU.format(cpu, name)) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def numa_nodes(use_hyperthreads=False):
+    # Lista de nós NUMA, cada um com os núcleos que este processo pode usar
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    for path in sorted(glob.glob(SYSFS_NODES), key=lambda p: int(os.path.basename(p)[4:])):
+        try:
+            with open(os.path.join(path, 'cpulist')) as f:
+                cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        except OSError:
+            continue
+        if cpus:
+            nodes.append(cpus)
+    if not nodes:
+        nodes = [sorted(allowed)]
+    if use_hyperthreads:
+        return nodes
+
+    seen = set()
+    physical = []
+    for cpus in nodes:
+        cores = []
+        for cpu in cpus:
+            core = (read_topology(cpu, 'physical_package_id'), read_topology(cpu, 'core_id'))
+            if core[1] is None or core not in seen:
+                seen.add(core)
+                cores.append(cpu)
+        physical.append(cores)
+    return physical
+
+
+def split_cores(nodes, nproc):
+    # Todo rank recebe o mesmo número de núcleos (os passos do DDP andam no ritmo do
+    # rank mais lento, então núcleos a mais em um rank só ficam ociosos). Primeiro saem
+    # grupos inteiros de dentro de cada nó NUMA; os ranks que faltam usam as sobras dos
+    # nós, em ordem, e só esses podem atravessar nós. O resto da divisão fica sem rank.
+    per_rank = sum(len(cpus) for cpus in nodes) // nproc
+    groups = []
+    spare = []
+    for cpus in nodes:
+        fits = len(cpus) // per_rank
+        groups.extend(cpus[k * per_rank:(k + 1) * per_rank] for k in range(fits))
+        spare.extend(cpus[fits * per_rank:])
+    while len(groups) < nproc:
+        groups.append(spare[:per_rank])
+        spare = spare[per_rank:]
+    return groups[:nproc]
+
+
+def run(groups, main_args, port, interop_threads, result_dir=None):
+    # Sobe um processo do main.py por grupo de núcleos e devolve os resultados por rank
+    nproc = len(groups)
+    owns_dir = result_dir is None
+    result_dir = result_dir or tempfile.mkdtemp(prefix='launch_')
+    processes = []
+    for rank, cpus in enumerate(groups):
+        env = dict(os.environ, RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(nproc),
+                   MASTER_ADDR='localhost', MASTER_PORT=str(port), OMP_NUM_THREADS=str(len(cpus)))
+        command = [sys.executable, MAIN, *main_args, '--threads', str(len(cpus)),
+                   '--interop-threads', str(interop_threads), '--result-dir', result_dir]
+        processes.append(subprocess.Popen(command, env=env,
+                                          preexec_fn=lambda cpus=cpus: os.sched_setaffinity(0, cpus)))
+    try:
+        codes = [None] * nproc
+        while None in codes:
+            codes = [process.poll() for process in processes]
+            if any(codes):
+                break
+            time.sleep(0.2)
+    finally:
+        # um rank caído deixa os outros presos no all-reduce
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+    if any(codes):
+        raise SystemExit(f"Rank(s) {[r for r, code in enumerate(codes) if code]} failed")
+
+    results = []
+    for rank in range(nproc):
+        with open(os.path.join(result_dir, f'rank_{rank}.json')) as f:
+            results.append(json.load(f))
+    if owns_dir:
+        shutil.rmtree(result_dir, ignore_errors=True)
+    return results
+
+
+def report(groups, results):
+    print(f"{'rank':>4} {'núcleos':<24}{'threads':>8}{'amostras/s':>12}{'ms/passo':>10}")
+    for cpus, result in zip(groups, results):
+        cores = ','.join(map(str, cpus)) if len(cpus) <= 6 else f"{cpus[0]}..{cpus[-1]} ({len(cpus)})"
+        print(f"{result['rank']:>4} {cores:<24}{result['threads']:>8}"
+              f"{result['rank_samples_per_sec']:>12.0f}{result['step_time_ms']:>10.2f}")
+    total = sum(result['rank_samples_per_sec'] for result in results)
+    print(f"total: {total:.0f} amostras/s com {len(groups)} rank(s)")
+    return total
+
+
+def candidates(nodes):
+    cores = sum(len(cpus) for cpus in nodes)
+    sizes = {1, len(nodes)}
+    size = 2
+    while size <= cores:
+        sizes.add(size)
+        size *= 2
+    return sorted(size for size in sizes if size <= cores)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lança o main.py dividindo os núcleos da CPU entre os ranks")
+    parser.add_argument("--nproc", default="auto", help="número de ranks ou 'auto'")
+    parser.add_argument("--use-hyperthreads", action="store_true", help="usa também as threads irmãs dos núcleos")
+    parser.add_argument("--interop-threads", type=int, default=1)
+    parser.add_argument("--trial-epochs", type=int, default=1, help="--nproc auto: épocas de cada teste")
+    parser.add_argument("--port", type=int, default=29500)
+    parser.add_argument("--result-dir", help="mantém os resultados por rank nesta pasta")
+    parser.add_argument("main_args", nargs=argparse.REMAINDER, help="argumentos do main.py, depois de --")
+    args = parser.parse_args()
+    main_args = args.main_args[1:] if args.main_args[:1] == ['--'] else args.main_args
+
+    nodes = numa_nodes(args.use_hyperthreads)
+    cores = sum(len(cpus) for cpus in nodes)
+    print(f"Topologia: {len(nodes)} nó(s) NUMA, {cores} núcleo(s): "
+          + " | ".join(f"nó {i}: {len(cpus)}" for i, cpus in enumerate(nodes)))
+
+    if args.nproc == "auto":
+        trial_args = main_args + ['--epochs', str(args.trial_epochs), '--checkpoint-dir', '',
+                                  '--eval-interval', '0', '--log-interval', '0']
+        best, best_total = 1, 0.0
+        for index, nproc in enumerate(candidates(nodes)):
+            print(f"\nTeste com {nproc} rank(s)...")
+            groups = split_cores(nodes, nproc)
+            total = report(groups, run(groups, trial_args, args.port + 1 + index, args.interop_threads))
+            if total > best_total:
+                best, best_total = nproc, total
+        print(f"\nMelhor vazão com {best} rank(s): {best_total:.0f} amostras/s\n")
+        nproc = best
+    else:
+        nproc = int(args.nproc)
+        if not 1 <= nproc <= cores:
+            parser.error(f"--nproc must be between 1 and the {cores} available cores")
+
+    groups = split_cores(nodes, nproc)
+    report(groups, run(groups, main_args, args.port, args.interop_threads, args.result_dir))
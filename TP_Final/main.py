@@ -1,18 +1,29 @@
+import argparse
+import json
 import os
+import time
+from contextlib import nullcontext
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.distributed as dist
-from torch.nn.parallel import DistributedDataParallel as DDP
-from torch.utils.data import DataLoader, TensorDataset
-from torch.utils.data.distributed import DistributedSampler
-from utils import ComplexNeuralNetwork, generate_dummy_data, evaluate_model
+from utils import ComplexNeuralNetwork, evaluate_model
+from data_prep import prepare_dataset, cache_path, load_split
+from batching import BatchIterator
+from comm import COMM_MODES, wrap_model, sync_parameters
+from checkpoint import Checkpointer
+from profiling import PHASES, StepProfiler
 
 def cleanup():
     dist.destroy_process_group()
 
-def run_ddp_training(rank, world_size, master_addr, master_port, num_epochs=10):
+def run_ddp_training(rank, world_size, master_addr, master_port, args):
     print(f"Process {rank}: Inicializando...")
+    # Com vários ranks na mesma máquina cada um deve usar só os seus núcleos (ver launch.py)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.interop_threads:
+        torch.set_num_interop_threads(args.interop_threads)
     
     dist.init_process_group(
         backend="gloo",
@@ -24,50 +35,185 @@ def run_ddp_training(rank, world_size, master_addr, master_port, num_epochs=10):
     print(f"Process {rank}: Process group inicializado.")
 
 
-    X_train, y_train, X_test, y_test = generate_dummy_data() 
+    # O dataset é gerado uma vez por máquina (local rank 0) e os demais esperam no barrier;
+    # com o cache já pronto ninguém gera nada. Cada rank mapeia só o seu shard do treino.
+    local_rank = int(os.environ.get("LOCAL_RANK", rank))
+    if local_rank == 0:
+        prepare_dataset(args.cache_dir, args.num_samples)
+    dist.barrier()
+    data_path = cache_path(args.cache_dir, args.num_samples)
+
+    X_shard, y_shard = load_split(data_path, "train", rank, world_size)
+    X_train, y_train = torch.from_numpy(X_shard), torch.from_numpy(y_shard)
+    print(f"Process {rank}: Shard com {len(X_train)} amostras de treino.")
     input_dim = X_train.shape[1]
     output_dim = 1
 
-    train_dataset = TensorDataset(X_train, y_train)
-    train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank)
+    # O shard já é a parte deste rank: os batches saem dele em bloco, com uma
+    # permutação por época e os próximos batches montados em um thread de fundo
+    train_dataloader = BatchIterator(X_train, y_train, batch_size=args.batch_size, seed=42, rank=rank,
+                                     prefetch=args.prefetch)
+    # O teste também é dividido entre os ranks, agora cobrindo todas as amostras
+    X_test, y_test = (torch.from_numpy(a) for a in load_split(data_path, "test", rank, world_size, equal=False))
 
-    train_dataloader = DataLoader(train_dataset, batch_size=64, sampler=train_sampler) 
 
+    # Tempo por fase de cada passo (ver profiling.py); opcionalmente um trace do torch.profiler
+    trace_steps = tuple(int(step) for step in args.trace_steps.split("-")) if args.trace_steps else None
+    profiler = StepProfiler(rank, trace_steps, args.trace_dir)
 
-    model = ComplexNeuralNetwork(input_dim, hidden_dim1=128, hidden_dim2=64, output_dim=output_dim)
-    model = DDP(model)
+    torch.manual_seed(42)
+    model = ComplexNeuralNetwork(input_dim, hidden_dim1=args.hidden1, hidden_dim2=args.hidden2, output_dim=output_dim)
+    # Medir o all-reduce troca o do DDP por um hook em Python (no fp32), então só com --profile-comm
+    model, averager = wrap_model(model, args.comm, args.bucket_cap_mb, args.powersgd_rank,
+                                 args.local_sgd_period, args.comm_warmup, profiler if args.profile_comm else None)
 
     criterion = nn.BCELoss()
     optimizer = optim.Adam(model.parameters(), lr=0.001) 
 
-    print(f"Process {rank}: Iniciando treinamento com ComplexNeuralNetwork...")
-    for epoch in range(num_epochs):
-        train_sampler.set_epoch(epoch) 
+    # Retoma do checkpoint completo mais recente, se houver
+    checkpointer = None
+    start_epoch = steps = 0
+    if args.checkpoint_dir:
+        config = {'input_dim': input_dim, 'hidden1': args.hidden1, 'hidden2': args.hidden2,
+                  'num_samples': args.num_samples}
+        checkpointer = Checkpointer(args.checkpoint_dir, rank, world_size, args.keep_checkpoints, config)
+        start_epoch, steps = checkpointer.resume(model.module, optimizer)
+        if averager is not None:
+            averager.step = steps
+        if start_epoch >= args.epochs:
+            print(f"Process {rank}: O checkpoint já tem as {args.epochs} épocas pedidas; nada a treinar "
+                  f"(aumente --epochs para continuar ou use outro --checkpoint-dir).")
+        elif start_epoch:
+            print(f"Process {rank}: Retomando do checkpoint, a partir da época {start_epoch+1}.")
+
+    print(f"Process {rank}: Iniciando treinamento com ComplexNeuralNetwork (comunicação {args.comm})...")
+    train_time = 0.0
+    first_step = steps
+    accuracy = test_loss = None
+    for epoch in range(start_epoch, args.epochs):
+        train_dataloader.set_epoch(epoch)
         model.train()
+        started = time.perf_counter()
+        optimizer.zero_grad()
+        profiler.start_epoch()
+        step_samples = 0
         for i, (inputs, labels) in enumerate(train_dataloader):
-            optimizer.zero_grad()
-            outputs = model(inputs)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-
-            if i % 10 == 0:
+            profiler.batch_ready()
+            # Acumulação de gradientes: só o último micro-batch de cada grupo sincroniza
+            step_now = (i + 1) % args.grad_accum == 0 or i + 1 == len(train_dataloader)
+            with nullcontext() if step_now else model.no_sync():
+                with profiler.phase("forward"):
+                    outputs = model(inputs)
+                    loss = criterion(outputs, labels)
+                with profiler.phase("backward"):
+                    (loss / args.grad_accum).backward()
+            step_samples += len(inputs)
+            if step_now:
+                with profiler.phase("optimizer"):
+                    optimizer.step()
+                    # o averager ignora parâmetros sem gradiente: faz a média antes do zero_grad
+                    if averager is not None:
+                        averager.average_parameters(model.parameters())
+                    optimizer.zero_grad()
+                steps += 1
+                profiler.end_step(step_samples)
+                step_samples = 0
+
+            if args.log_interval and i % args.log_interval == 0:
                 print(f"\nProcess {rank}: Epoch {epoch+1}, Batch {i+1}/{len(train_dataloader)}, Loss: {loss.item():.4f}")
-
+        train_time += time.perf_counter() - started
+
+        # Avalia a cada eval_interval épocas e sempre na última; idem para o checkpoint
+        last = epoch + 1 == args.epochs
+        evaluate_now = last or (args.eval_interval > 0 and (epoch + 1) % args.eval_interval == 0)
+        checkpoint_now = checkpointer is not None and (
+            last or (args.checkpoint_interval > 0 and (epoch + 1) % args.checkpoint_interval == 0))
+        if averager is not None and (evaluate_now or checkpoint_now):
+            sync_parameters(model)
+        if evaluate_now:
+            accuracy, test_loss = evaluate_model(model.module, X_test, y_test, args.eval_batch_size)
+            if rank == 0:
+                print(f"Process {rank}: Epoch {epoch+1}, Acuracia de teste: {accuracy:.4f}, Loss de teste: {test_loss:.4f}")
+        if checkpoint_now:
+            # a gravação segue em um thread de fundo enquanto a próxima época treina
+            checkpointer.save(epoch + 1, model.module, optimizer, steps)
+
+    if checkpointer is not None:
+        checkpointer.close()
+    if start_epoch >= args.epochs:
+        # execução já concluída: só avalia o modelo do checkpoint
+        accuracy, test_loss = evaluate_model(model.module, X_test, y_test, args.eval_batch_size)
         if rank == 0:
-            dist.barrier() 
-            accuracy = evaluate_model(model.module, X_test, y_test)
-            print(f"Process {rank}: Epoch {epoch+1}, Acuracia de teste: {accuracy:.4f}")
-        else:
-            dist.barrier()
-
-    print(f"Process {rank}: Treinamento concluído.\n")
+            print(f"Process {rank}: Acuracia de teste: {accuracy:.4f}, Loss de teste: {test_loss:.4f}")
+
+    rank_samples_per_sec = (args.epochs - start_epoch) * len(X_train) / train_time if train_time else 0.0
+    result = {
+        'rank': rank,
+        'threads': torch.get_num_threads(),
+        'step_time_ms': 1000 * train_time / max(steps - first_step, 1),
+        'rank_samples_per_sec': rank_samples_per_sec,
+        'samples_per_sec': rank_samples_per_sec * world_size,
+        'accuracy': accuracy,
+        'test_loss': test_loss,
+        'profile': profiler.summary(),
+    }
+    if args.result_dir:
+        os.makedirs(args.result_dir, exist_ok=True)
+        with open(os.path.join(args.result_dir, f"rank_{rank}.json"), "w") as f:
+            json.dump(result, f)
+    if train_time:
+        print(f"Process {rank}: Treinamento concluído ({result['step_time_ms']:.2f} ms por passo, "
+              f"{rank_samples_per_sec:.0f} amostras/s neste rank com {result['threads']} threads).")
+        profile = result['profile']
+        print(f"Process {rank}: Passo p50 {profile['step_time_ms']['p50']:.2f} ms, p99 {profile['step_time_ms']['p99']:.2f} ms; "
+              + ", ".join(f"{phase} {profile['phases_ms'][phase]['mean']:.2f}" for phase in PHASES)
+              + " (ms médios por passo)\n")
     cleanup()
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Treinamento distribuído com PyTorch DDP")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--num-samples", type=int, default=int(os.environ.get("NUM_SAMPLES", 10000)))
+    parser.add_argument("--cache-dir", default=os.environ.get("DATA_CACHE", "data_cache"))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--prefetch", type=int, default=2, help="batches montados à frente (0: sem thread)")
+    parser.add_argument("--eval-interval", type=int, default=1,
+                        help="avalia a cada N épocas (0: só na última)")
+    parser.add_argument("--eval-batch-size", type=int, default=1024)
+    parser.add_argument("--log-interval", type=int, default=10, help="imprime a loss a cada N batches (0: nunca)")
+    parser.add_argument("--comm", choices=COMM_MODES, default="fp32",
+                        help="compressão dos gradientes ou local SGD (ver comm.py)")
+    parser.add_argument("--bucket-cap-mb", type=float, default=25, help="tamanho dos buckets do all-reduce")
+    parser.add_argument("--grad-accum", type=int, default=1,
+                        help="micro-batches por passo do otimizador (sincroniza só no último)")
+    parser.add_argument("--powersgd-rank", type=int, default=1)
+    parser.add_argument("--local-sgd-period", type=int, default=4, help="localsgd: passos entre as médias")
+    parser.add_argument("--comm-warmup", type=int, default=10,
+                        help="passos com all-reduce completo antes de powersgd/localsgd")
+    parser.add_argument("--checkpoint-dir", default="",
+                        help="pasta dos checkpoints; retoma do mais recente ao iniciar (padrão: sem checkpoints)")
+    parser.add_argument("--checkpoint-interval", type=int, default=1, help="épocas entre checkpoints (0: só na última)")
+    parser.add_argument("--keep-checkpoints", type=int, default=3, help="checkpoints completos mantidos")
+    parser.add_argument("--threads", type=int, default=0, help="threads intra-op por rank (0: padrão do PyTorch)")
+    parser.add_argument("--interop-threads", type=int, default=0, help="threads inter-op por rank (0: padrão)")
+    parser.add_argument("--result-dir", default="", help="grava o resultado de cada rank em <dir>/rank_R.json")
+    parser.add_argument("--hidden1", type=int, default=128, help="neurônios da primeira camada oculta")
+    parser.add_argument("--hidden2", type=int, default=64, help="neurônios da segunda camada oculta")
+    parser.add_argument("--trace-steps", default="", help="INÍCIO-FIM: grava um trace do torch.profiler desses passos")
+    parser.add_argument("--trace-dir", default="traces")
+    parser.add_argument("--profile-comm", action="store_true",
+                        help="mede a fase allreduce envolvendo o comm hook (no fp32 troca o all-reduce nativo do DDP)")
+    return parser
 
 if __name__ == "__main__":
+    # o launcher do PyTorch acrescenta --local-rank; argumentos desconhecidos são ignorados
+    args, _ = build_parser().parse_known_args()
+
     rank = int(os.environ["RANK"])
     world_size = int(os.environ["WORLD_SIZE"])
     master_addr = os.environ["MASTER_ADDR"]
     master_port = os.environ["MASTER_PORT"]
 
-    run_ddp_training(rank, world_size, master_addr, master_port)
\ No newline at end of file
+    run_ddp_training(rank, world_size, master_addr, master_port, args)
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import time
+from contextlib import nullcontext
+import torch
+
+# --- Instrumentação do laço de treino ---
+# Mede, por passo do otimizador, o tempo de cada fase:
+#   data       espera pelo próximo batch do BatchIterator (e o que mais rodar entre
+#              os passos, como o print da loss)
+#   forward    forward + loss
+#   backward   backward; inclui a espera pelo fim do all-reduce do último bucket
+#   allreduce  soma da latência dos buckets, do hook do DDP até o fim da comunicação;
+#              roda em paralelo com o backward, então não soma com as outras fases.
+#              Só é medida com --profile-comm (senão fica 0): no fp32 medir exige trocar
+#              o all-reduce nativo do DDP pelo allreduce_hook em Python
+#   optimizer  optimizer.step() (e a média de parâmetros do local SGD)
+# Com acumulação de gradientes os micro-batches de um passo somam no mesmo passo.
+# Com trace_steps=(início, fim) os passos nesse intervalo são gravados com o
+# torch.profiler em <trace_dir>/rank<R>_steps<início>-<fim>.json (chrome://tracing).
+
+PHASES = ['data', 'forward', 'backward', 'allreduce', 'optimizer']
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class StepProfiler:
+    def __init__(self, rank=0, trace_steps=None, trace_dir='traces'):
+        self.rank = rank
+        self.trace_steps = trace_steps
+        self.trace_dir = trace_dir
+        self.tracer = None
+        self.history = {phase: [] for phase in PHASES}
+        self.step_times = []
+        self.samples = 0
+        self.current = dict.fromkeys(PHASES, 0.0)
+        # os callbacks do all-reduce rodam em threads do gloo: cada bucket vai para a lista
+        self.buckets = []
+        self.step_started = None
+        self.last_mark = None
+
+    def start_epoch(self):
+        self.last_mark = time.perf_counter()
+
+    def batch_ready(self):
+        # chamado no início do corpo do laço: o tempo desde a última marca foi esperando dados
+        now = time.perf_counter()
+        if self.step_started is None:
+            self.step_started = self.last_mark
+            self.start_trace()
+        self.current['data'] += now - self.last_mark
+        self.last_mark = now
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def record(self, name, elapsed):
+        self.current[name] += elapsed
+
+    def end_step(self, samples):
+        now = time.perf_counter()
+        self.last_mark = now
+        self.current['allreduce'] = sum(self.buckets)
+        self.buckets.clear()
+        for phase in PHASES:
+            self.history[phase].append(self.current[phase])
+            self.current[phase] = 0.0
+        self.step_times.append(now - self.step_started)
+        self.step_started = None
+        self.samples += samples
+        self.stop_trace()
+
+    def start_trace(self):
+        if self.trace_steps and len(self.step_times) + 1 == self.trace_steps[0]:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            self.tracer = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                                 record_shapes=True)
+            self.tracer.start()
+
+    def stop_trace(self):
+        if self.tracer is not None and len(self.step_times) >= self.trace_steps[1]:
+            self.tracer.stop()
+            first, last = self.trace_steps
+            path = f"{self.trace_dir}/rank{self.rank}_steps{first}-{last}.json"
+            self.tracer.export_chrome_trace(path)
+            self.tracer = None
+            print(f"Process {self.rank}: Trace dos passos {first}-{last} gravado em {path}")
+
+    def timed_hook(self, hook):
+        # Envolve um comm hook do DDP medindo cada bucket até a comunicação terminar
+        def wrapper(state, bucket):
+            started = time.perf_counter()
+            future = hook(state, bucket)
+
+            def done(fut):
+                self.buckets.append(time.perf_counter() - started)
+                return fut.value()
+            return future.then(done)
+        return wrapper
+
+    def summary(self):
+        total = sum(self.step_times)
+        return {
+            'steps': len(self.step_times),
+            'samples_per_sec': self.samples / total if total else 0.0,
+            'step_time_ms': {
+                'mean': 1000 * total / len(self.step_times) if self.step_times else 0.0,
+                'p50': 1000 * percentile(self.step_times, 50),
+                'p90': 1000 * percentile(self.step_times, 90),
+                'p99': 1000 * percentile(self.step_times, 99),
+            },
+            'phases_ms': {
+                phase: {
+                    'mean': 1000 * sum(values) / len(values) if values else 0.0,
+                    'p50': 1000 * percentile(values, 50),
+                    'p99': 1000 * percentile(values, 99),
+                }
+                for phase, values in self.history.items()
+            },
+        }
+
+
+class Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.label = torch.profiler.record_function(name) if profiler.tracer is not None else nullcontext()
+
+    def __enter__(self):
+        self.label.__enter__()
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        now = time.perf_counter()
+        self.profiler.record(self.name, now - self.started)
+        self.profiler.last_mark = now
+        self.label.__exit__(*exc)
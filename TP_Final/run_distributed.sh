@@ -10,22 +10,37 @@ export MASTER_PORT="29500" # Porta para comunicação
 # Geralmente, este é o número de GPUs ou CPUs que você quer usar.
 export WORLD_SIZE=3 
 
+# Tamanho do dataset e pasta do cache gerado por data_prep.py (gerado uma vez e reutilizado)
+export NUM_SAMPLES=10000
+export DATA_CACHE="data_cache"
+
 # Ativa o ambiente virtual
 source venv/Scripts/activate
 
 echo "Iniciando treinamento distribuído com PyTorch DDP..."
 
+# Tentativas de reinício: se um worker cai, o torchrun derruba o grupo e sobe todos
+# de novo; o main.py retoma do último checkpoint completo em ./checkpoints
+export MAX_RESTARTS=3
+
 # Comando para iniciar o treinamento distribuído
-# -m torch.distributed.launch é o utilitário do PyTorch
-# --nproc_per_node: número de processos a serem lançados neste nó.
+# torchrun substitui o torch.distributed.launch (obsoleto) e roda em modo elástico:
+# --nproc-per-node: número de processos a serem lançados neste nó.
 #                   Como estamos em uma única máquina, será WORLD_SIZE.
-#                   Em um cluster, cada máquina rodaria com nproc_per_node
-#                   igual ao número de CPUs/GPUs dessa máquina.
-python -m torch.distributed.launch \
-    --nproc_per_node=$WORLD_SIZE \
-    --master_addr=$MASTER_ADDR \
-    --master_port=$MASTER_PORT \
-    main.py
+#                   Em um cluster, cada máquina rodaria com nproc-per-node
+#                   igual ao número de CPUs/GPUs dessa máquina e --nnodes=MIN:MAX,
+#                   o mesmo --rdzv-id e o mesmo --rdzv-endpoint em todas.
+# O torchrun define RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR e MASTER_PORT de cada worker.
+# Em uma única máquina, `python launch.py --nproc auto -- <args do main.py>` também divide
+# os núcleos da CPU entre os ranks (afinidade e threads por rank), sem reinícios.
+torchrun \
+    --nnodes=1 \
+    --nproc-per-node=$WORLD_SIZE \
+    --max-restarts=$MAX_RESTARTS \
+    --rdzv-id=tp_final \
+    --rdzv-backend=c10d \
+    --rdzv-endpoint=$MASTER_ADDR:$MASTER_PORT \
+    main.py --checkpoint-dir checkpoints
 
 echo "Treinamento distribuído concluído."
 
@@ -0,0 +1,42 @@
+import unittest
+from launch import split_cores
+
+# Divisão dos núcleos entre os ranks (não precisa do torch).
+#   python3 -m unittest test_launch
+
+
+class SplitCoresTest(unittest.TestCase):
+    def assert_balanced(self, nodes, nproc):
+        groups = split_cores(nodes, nproc)
+        self.assertEqual(len(groups), nproc)
+        self.assertEqual({len(group) for group in groups}, {sum(map(len, nodes)) // nproc})
+        used = [cpu for group in groups for cpu in group]
+        self.assertEqual(len(used), len(set(used)))
+        return groups
+
+    def test_fewer_ranks_than_nodes(self):
+        self.assertEqual(self.assert_balanced([[0, 1], [2, 3], [4, 5]], 2), [[0, 1, 2], [3, 4, 5]])
+
+    def test_one_rank_per_node(self):
+        self.assertEqual(self.assert_balanced([[0, 1], [2, 3], [4, 5]], 3), [[0, 1], [2, 3], [4, 5]])
+
+    def test_ranks_stay_inside_nodes(self):
+        groups = self.assert_balanced([[0, 1, 2, 3, 4, 5], [6, 7, 8, 9, 10, 11]], 4)
+        self.assertEqual(groups, [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9, 10, 11]])
+
+    def test_uneven_nodes(self):
+        groups = self.assert_balanced([[0, 1, 2, 3, 4], [5, 6, 7]], 2)
+        self.assertEqual(groups, [[0, 1, 2, 3], [4, 5, 6, 7]])
+
+    def test_remainder_left_idle(self):
+        self.assertEqual(self.assert_balanced([[0, 1, 2, 3, 4, 5, 6]], 3), [[0, 1], [2, 3], [4, 5]])
+
+    def test_single_rank(self):
+        self.assertEqual(split_cores([[0, 1], [2, 3]], 1), [[0, 1, 2, 3]])
+
+    def test_one_core_per_rank(self):
+        self.assertEqual(self.assert_balanced([[0, 1], [2]], 3), [[0], [1], [2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
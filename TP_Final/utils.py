@@ -1,9 +1,6 @@
 import torch
 import torch.nn as nn
-from sklearn.datasets import make_classification
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import accuracy_score
+import torch.distributed as dist
 
 # --- Novo Modelo: Rede Neural Multi-Camadas ---
 class ComplexNeuralNetwork(nn.Module):
@@ -22,30 +19,22 @@ class ComplexNeuralNetwork(nn.Module):
         x = self.dropout2(self.relu2(self.layer2(x)))
         return torch.sigmoid(self.output_layer(x)) # Para classificação binária
 
-# --- Função de Geração de Dados (Aumentando num_samples) ---
-def generate_dummy_data(num_samples=10000, n_features=20): # Aumentei num_samples e n_features
-    # Aumentando num_samples para 10000 e n_features para 20 (ou mais) para dificultar
-    X, y = make_classification(n_samples=num_samples, n_features=n_features,
-                               n_informative=10, n_redundant=5, # Mais features informativas e redundantes
-                               n_classes=2, random_state=42)
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-    scaler = StandardScaler()
-    X_train = scaler.fit_transform(X_train)
-    X_test = scaler.transform(X_test)
-
-    X_train = torch.tensor(X_train, dtype=torch.float32)
-    y_train = torch.tensor(y_train, dtype=torch.float32).view(-1, 1)
-    X_test = torch.tensor(X_test, dtype=torch.float32)
-    y_test = torch.tensor(y_test, dtype=torch.float32).view(-1, 1)
-
-    return X_train, y_train, X_test, y_test
-
-# --- Função de Avaliação Permanece a Mesma ---
-def evaluate_model(model, X_test, y_test):
+# --- Avaliação distribuída em batches ---
+# Cada rank avalia o seu shard do teste em batches de tamanho fixo (memória constante
+# mesmo com um teste grande); acertos, soma da loss e número de amostras são somados
+# entre os ranks com um único all_reduce, então todos recebem a mesma acurácia e loss.
+def evaluate_model(model, X_test, y_test, batch_size=1024):
     model.eval()
+    totals = torch.zeros(3, dtype=torch.float64)
     with torch.no_grad():
-        outputs = model(X_test)
-        predictions = (outputs >= 0.5).float()
-        accuracy = accuracy_score(y_test.numpy(), predictions.numpy())
-    return accuracy
\ No newline at end of file
+        for start in range(0, len(X_test), batch_size):
+            inputs = X_test[start:start + batch_size]
+            labels = y_test[start:start + batch_size]
+            outputs = model(inputs)
+            totals[0] += ((outputs >= 0.5).float() == labels).sum().item()
+            totals[1] += nn.functional.binary_cross_entropy(outputs, labels, reduction='sum').item()
+            totals[2] += len(inputs)
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(totals)
+    correct, loss, count = totals.tolist()
+    return correct / max(count, 1), loss / max(count, 1)